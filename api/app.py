@@ -1,37 +1,110 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, make_response, request
+from flask.json.provider import DefaultJSONProvider
 from pymongo import MongoClient
-from datetime import datetime
+from pymongo.errors import OperationFailure, PyMongoError
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import base64
+import csv
+import functools
+import hashlib
+import io
+import json
 import os
+import sqlite3
+import threading
+import time
+import zlib
 from dotenv import load_dotenv
 import numpy as np
 import math
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow / Parquet responses are optional
+    pa = None
+    pq = None
+
+def _json_default(o):
+    """JSON fallback: ISO 8601 for datetimes (e.g. ``timestamp``), str() otherwise."""
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return str(o)
+
+
+class _JSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = _JSONProvider(app)
 
-# Connect to Mongo
 load_dotenv()
 
-MONGO_URI = os.getenv("MONGODB_URI")
-MONGO_PASS = os.getenv("MONGO_PASS")
-MONGO_USER = os.getenv("MONGO_USER")
+# Storage backend: "mongo" (default) queries asv_1; "local" answers the same
+# endpoints from the memory-mapped column store main/main.py writes, with no
+# MongoDB connection at all.
+API_BACKEND = os.getenv("API_BACKEND", "mongo").lower()
+LOCAL_STORE_DIR = os.getenv("LOCAL_STORE_DIR",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "columns"))
+
+# Serving: `python api/app.py` runs waitress with API_THREADS request threads;
+# API_SERVER=dev runs Flask's debug server instead. Every request thread and
+# every in-request query (_query_pool) may hold a MongoDB connection at once,
+# so MONGO_POOL_SIZE should cover API_THREADS plus API_QUERY_WORKERS.
+API_SERVER = os.getenv("API_SERVER", "waitress").lower()
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", 5000))
+API_THREADS = int(os.getenv("API_THREADS", 32))
+API_QUERY_WORKERS = int(os.getenv("API_QUERY_WORKERS", 32))
+API_CHANNEL_TIMEOUT = int(os.getenv("API_CHANNEL_TIMEOUT", 120))  # seconds an idle client connection is kept
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", 100))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", 30000))  # per operation, including the wait for a connection
 
-if not all([MONGO_URI, MONGO_USER, MONGO_PASS]):
-    print("ERROR: Missing MongoDB credentials!")
+if API_BACKEND not in ("mongo", "local"):
+    print("ERROR: API_BACKEND must be 'mongo' or 'local'")
     exit(1)
 
-url= f"mongodb+srv://{MONGO_USER}:{MONGO_PASS}@{MONGO_URI}/?retryWrites=true&w=majority"
+client = db = collection = stats_collection = meta_collection = tiles_collection = None
+if API_BACKEND == "mongo":
+    # Connect to Mongo
+    MONGO_URI = os.getenv("MONGODB_URI")
+    MONGO_PASS = os.getenv("MONGO_PASS")
+    MONGO_USER = os.getenv("MONGO_USER")
 
-client = MongoClient(url)
-try:
-    # The ismaster command is cheap and does not require auth
-    client.admin.command('ping')
-    print("MongoDB connection successful!")
-except Exception as e:
-    print("MongoDB connection failed:", e)
-    
+    if not all([MONGO_URI, MONGO_USER, MONGO_PASS]):
+        print("ERROR: Missing MongoDB credentials!")
+        exit(1)
+
+    url= f"mongodb+srv://{MONGO_USER}:{MONGO_PASS}@{MONGO_URI}/?retryWrites=true&w=majority"
+
+    # timeoutMS bounds every operation end to end (server selection, waiting
+    # for a pooled connection, and the query itself on the server)
+    client = MongoClient(url, maxPoolSize=MONGO_POOL_SIZE, timeoutMS=MONGO_TIMEOUT_MS)
+    try:
+        # The ismaster command is cheap and does not require auth
+        client.admin.command('ping')
+        print("MongoDB connection successful!")
+    except Exception as e:
+        print("MongoDB connection failed:", e)
 
-db = client["water_quality_data"]
-collection = db["asv_1"]
+
+    db = client["water_quality_data"]
+    collection = db["asv_1"]
+    # per-date field summaries written by main/main.py
+    stats_collection = db["field_stats"]
+    # dataset generation stamp, bumped by main/main.py after every load
+    meta_collection = db["dataset_meta"]
+    # per-zoom map tile aggregates written by main/main.py
+    tiles_collection = db["geo_tiles"]
 
 
 def _parse_iso_timestamp(ts_str):
@@ -42,8 +115,140 @@ def _parse_iso_timestamp(ts_str):
     if s.endswith("Z"):
         s = s[:-1] + "+00:00"
     parsed = datetime.fromisoformat(s)
+    if parsed.tzinfo is not None:
+        # stored timestamps are naive UTC and cannot be compared with aware ones
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
     return ts_str, parsed
 
+# Keyset pagination: observations are returned in this order and a page's
+# cursor encodes the sort values of its last document, so page N costs the
+# same as page 1 (no documents are walked and discarded as with skip).
+OBSERVATION_SORT = ["timestamp", "_id"]
+
+
+def _encode_cursor(doc):
+    timestamp = doc.get("timestamp")
+    values = [timestamp.isoformat() if timestamp is not None else None, str(doc["_id"])]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(token):
+    """Sort values from a cursor token; raises ValueError if it is malformed."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(OBSERVATION_SORT):
+            raise ValueError
+        timestamp = datetime.fromisoformat(values[0]) if values[0] is not None else None
+        return [timestamp, backend.parse_id(values[1])]
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def _after_cursor(values):
+    """Filter for documents strictly after ``values`` in OBSERVATION_SORT order."""
+    clauses = []
+    for i, field in enumerate(OBSERVATION_SORT):
+        clause = dict(zip(OBSERVATION_SORT[:i], values[:i]))
+        # null/missing sorts before every other value
+        clause[field] = {"$gt": values[i]} if values[i] is not None else {"$ne": None}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+#----- Storage Backend -----
+class MongoBackend:
+    """Storage interface over asv_1 and the collections ingest derives from it.
+
+    LocalEngine (api/local_engine.py) implements the same methods over the
+    local column store, so the endpoints that go through ``backend`` run
+    unchanged on either. Filters are MongoDB filter documents, ``after`` is a
+    decoded page cursor, and rows come back in OBSERVATION_SORT order with
+    their ``_id``.
+    """
+
+    name = "mongo"
+
+    def generation(self):
+        doc = meta_collection.find_one({"_id": collection.name}) or {}
+        return doc.get("generation", 0)
+
+    @staticmethod
+    def parse_id(value):
+        return ObjectId(value)
+
+    def dates(self):
+        return collection.distinct("date")
+
+    def count(self, q):
+        return collection.count_documents(q)
+
+    def estimated_count(self, q):
+        return _estimated_count(q)
+
+    def find(self, q, fields=None, after=None, skip=0, limit=None):
+        if after:
+            q = {"$and": [q, _after_cursor(after)]} if q else _after_cursor(after)
+        # "location" is the GeoJSON copy of latitude/longitude kept for the 2dsphere index
+        projection = {f: 1 for f in fields} if fields else {"location": 0}
+        cursor = (collection.find(q, projection)
+                  .sort([(f, 1) for f in OBSERVATION_SORT])
+                  .skip(skip)
+                  .batch_size(EXPORT_BATCH_SIZE))
+        return cursor.limit(limit) if limit is not None else cursor
+
+    def field_stats(self, fields, start_day=None, end_day=None):
+        """({field: stats}, source): precomputed ingest summaries first; anything
+        they don't cover is computed live with one aggregation, running
+        alongside the summary read."""
+        summarized = _summarized_fields()
+        live_fields = [f for f in fields if f not in summarized]
+        live = _query_pool.submit(self._live_stats, live_fields, start_day, end_day) if live_fields else None
+        stats = _summary_stats(fields, start_day, end_day)
+        if live is not None:
+            stats.update(live.result())
+        source = "live" if len(live_fields) == len(fields) else "summary" if not live_fields else "mixed"
+        return stats, source
+
+    @staticmethod
+    def _live_stats(fields, start_day, end_day):
+        match = None
+        if start_day or end_day:
+            match = {"date": {"$in": _dates_in_range(start_day, end_day)}}
+        return _field_stats(fields, match)
+
+    def outlier_page(self, field, lower, upper, fields, after=None, limit=None):
+        """(total, up to ``limit`` rows) with ``field`` outside [lower, upper]."""
+        pipeline = _outlier_page_pipeline(_outlier_match(field, lower, upper), fields, after, limit)
+        result = next(collection.aggregate(pipeline))
+        return (result["total"][0]["n"] if result["total"] else 0), result["items"]
+
+    def iter_outliers(self, field, lower, upper, fields, after=None, limit=None):
+        match = _outlier_match(field, lower, upper)
+        pipeline = [{"$match": {"$and": [match, _after_cursor(after)]} if after else match},
+                    {"$sort": {f: 1 for f in OBSERVATION_SORT}}]
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": {f: 1 for f in fields}})
+        return collection.aggregate(pipeline, allowDiskUse=True)
+
+
+def mongo_only(view):
+    """501 for the endpoints only the MongoDB backend answers."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if backend.name != "mongo":
+            return jsonify({"error": f"{request.path} is not available with API_BACKEND={backend.name}"}), 501
+        return view(*args, **kwargs)
+    return wrapper
+
+
+if API_BACKEND == "local":
+    from local_engine import LocalEngine
+    backend = LocalEngine(LOCAL_STORE_DIR)
+else:
+    backend = MongoBackend()
+
 # In Flask app.py
 def clean_nan(obj):
     """Replace NaN with None for JSON serialization"""
@@ -60,55 +265,330 @@ def clean_nan(obj):
 # items = clean_nan(items)
 # return jsonify({"count": total, "items": items})
 
+#----- Response Cache -----
+# The data only changes when main/main.py runs, so rendered responses are
+# cached per (endpoint, query parameters, dataset generation). Ingest bumps the
+# generation, which retires every older entry without any explicit flush.
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", 300))  # seconds
+API_CACHE_SIZE = int(os.getenv("API_CACHE_SIZE", 512))  # in-process entries
+API_CACHE_PATH = os.getenv("API_CACHE_PATH")  # optional SQLite file shared between workers
+GENERATION_CHECK_INTERVAL = 5  # seconds between generation checks
+
+_generation = {"value": 0, "checked": 0.0}
+_generation_lock = threading.Lock()
+
+
+def _dataset_generation():
+    """Current dataset generation, re-read at most every GENERATION_CHECK_INTERVAL seconds."""
+    now = time.monotonic()
+    with _generation_lock:
+        if now - _generation["checked"] < GENERATION_CHECK_INTERVAL:
+            return _generation["value"]
+    generation = backend.generation()
+    with _generation_lock:
+        _generation["value"] = generation
+        _generation["checked"] = now
+        return _generation["value"]
+
+
+class ResponseCache:
+    """LRU + TTL cache of rendered responses, optionally backed by SQLite on disk.
+
+    The disk layer lets several API processes share one cache; entries from
+    older dataset generations are purged from it on write.
+    """
+
+    def __init__(self, max_entries, ttl, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        if path:
+            with self._db() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, generation INTEGER, expires REAL, "
+                    "status INTEGER, headers TEXT, body BLOB)"
+                )
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            hit = self.entries.get(key)
+            if hit and hit[0] > now:
+                self.entries.move_to_end(key)
+                return hit[1]
+            self.entries.pop(key, None)
+        if not self.path:
+            return None
+        with self._db() as conn:
+            row = conn.execute("SELECT expires, status, headers, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if not row or row[0] <= now:
+            return None
+        entry = (row[1], json.loads(row[2]), row[3])
+        self._remember(key, entry, row[0])
+        return entry
+
+    def set(self, key, generation, entry):
+        expires = time.time() + self.ttl
+        self._remember(key, entry, expires)
+        if self.path:
+            status, headers, body = entry
+            with self._db() as conn:
+                conn.execute("DELETE FROM responses WHERE generation < ? OR expires <= ?", (generation, time.time()))
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, generation, expires, status, json.dumps(headers), body))
+
+    def _remember(self, key, entry, expires):
+        with self.lock:
+            self.entries[key] = (expires, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+_response_cache = ResponseCache(API_CACHE_SIZE, API_CACHE_TTL, API_CACHE_PATH)
+
+# response headers worth replaying from the cache
+_CACHED_HEADERS = ["Content-Type", "X-Stats-Source", "X-Total-Count", "X-Count-Type", "X-Next-Cursor"]
+
+
+# cache keys being computed right now -> Event set once the result is cached
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _render_once(key, generation, view, args, kwargs):
+    """(response, cache status) for a cache miss, computing each key only once.
+
+    When many dashboards ask for the same uncached response together, one
+    request runs the queries and the rest wait for its cache entry instead
+    of repeating them.
+    """
+    with _inflight_lock:
+        done = _inflight.get(key)
+        leader = done is None
+        if leader:
+            done = _inflight[key] = threading.Event()
+    if not leader:
+        done.wait(MONGO_TIMEOUT_MS / 1000)
+        hit = _response_cache.get(key)
+        if hit is not None:
+            status, headers, body = hit
+            return app.response_class(body, status=status, headers=headers), "HIT"
+    try:
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response, None
+        headers = {h: response.headers[h] for h in _CACHED_HEADERS if h in response.headers}
+        _response_cache.set(key, generation, (response.status_code, headers, response.get_data()))
+        return response, "MISS"
+    finally:
+        if leader:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+            done.set()
+
+
+def cached_response(view):
+    """Serve a GET endpoint from the response cache, with ETag / If-None-Match.
+
+    The ETag is derived from the cache key alone, so a client revalidating an
+    unchanged dataset gets a 304 before any query runs.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = _dataset_generation()
+        params = urlencode(sorted(request.args.items(multi=True)))
+        key = f"{generation}|{request.path}?{params}|{request.headers.get('Accept', '')}"
+        etag = f"{generation}-{hashlib.sha1(key.encode()).hexdigest()[:20]}"
+
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            hit = _response_cache.get(key)
+            if hit is not None:
+                status, headers, body = hit
+                response = app.response_class(body, status=status, headers=headers)
+                response.headers["X-Cache"] = "HIT"
+            else:
+                response, status = _render_once(key, generation, view, args, kwargs)
+                if status is None:
+                    return response
+                response.headers["X-Cache"] = status
+
+        response.set_etag(etag, weak=True)
+        response.headers["X-Dataset-Generation"] = str(generation)
+        return response
+    return wrapper
+
+
 #----- Health Check -----
 @app.route("/api/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "backend": backend.name, "dataset_generation": _dataset_generation()})
 
 
 #----- Get Available Dates -----
 @app.route("/api/dates", methods=["GET"])
+@cached_response
 def get_dates():
-    try:
-        dates = collection.distinct("Date")
-        dates = sorted([d for d in dates if d])
-        return jsonify({"dates": dates})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    # database errors reach database_error, which answers 503 or 504
+    dates = sorted([d for d in backend.dates() if d])
+    return jsonify({"dates": dates})
+
+# Independent queries inside one request run on this pool
+_query_pool = ThreadPoolExecutor(max_workers=API_QUERY_WORKERS, thread_name_prefix="api-query")
+
+# ?count= strategies for /api/observations
+COUNT_MODES = ["exact", "estimated", "cached", "none"]
+COUNT_CACHE_TTL = 300  # seconds
+COUNT_CACHE_SIZE = 1024
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+
+def _cached_count(q):
+    """Exact count memoized per normalized query for COUNT_CACHE_TTL seconds."""
+    key = f"{_dataset_generation()}|{json.dumps(q, sort_keys=True, default=str)}"
+    now = time.monotonic()
+    with _count_cache_lock:
+        hit = _count_cache.get(key)
+        if hit and now - hit[1] < COUNT_CACHE_TTL:
+            _count_cache.move_to_end(key)
+            return hit[0], "cached"
+    total = backend.count(q)
+    with _count_cache_lock:
+        _count_cache[key] = (total, now)
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return total, "exact"
+
+
+def _estimated_count(q):
+    """Metadata or ingest-summary count, or None when ``q`` needs a real count."""
+    if not q:
+        return collection.estimated_document_count()
+    days = _whole_days(q)
+    if days is not None:
+        # every cleaned row is counted once per (source file, date) summary
+        rows = list(stats_collection.aggregate([
+            {"$match": {"day": days}},
+            {"$group": {"_id": {"source_file": "$source_file", "date": "$date"}, "rows": {"$max": "$rows"}}},
+            {"$group": {"_id": None, "rows": {"$sum": "$rows"}}}
+        ]))
+        if rows and rows[0]["rows"]:
+            return rows[0]["rows"]
+    return None
+
+
+def _whole_days(q):
+    """ISO day condition for a filter that is only a midnight-to-midnight
+    timestamp range, else None."""
+    if set(q) != {"timestamp"}:
+        return None
+    bounds = q["timestamp"]
+    cond = {}
+    for op, day_op, shift in (("$gte", "$gte", 0), ("$lt", "$lte", -1)):
+        if op in bounds:
+            bound = bounds[op]
+            if bound.tzinfo is not None or bound != datetime.combine(bound.date(), datetime.min.time()):
+                return None
+            cond[day_op] = (bound + timedelta(days=shift)).strftime("%Y-%m-%d")
+    return cond
+
+
+def _count_observations(q, mode):
+    """(count, count_type) for ``q`` using the requested ?count= strategy."""
+    if mode == "none":
+        return None, "none"
+    if mode == "cached":
+        return _cached_count(q)
+    if mode == "estimated":
+        estimate = backend.estimated_count(q)
+        if estimate is not None:
+            return estimate, "estimated"
+    return backend.count(q), "exact"
+
 
 #----- Get Observations -----
-@app.route("/api/observations", methods=["GET"])
-def get_observations():
-    # Build MongoDB query
+# Page layouts: "rows" is a list of objects; "columns" and "arrow" send each
+# field once with all its values, which is far smaller and loads straight
+# into a DataFrame.
+OBSERVATION_LAYOUTS = ("rows", "columns", "arrow")
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+
+def _time_range_args():
+    """[start, end) datetimes for the request, either bound None when open.
+
+    ?start=/?end= take ISO 8601 timestamps, an offset converted to UTC; the day parameters ?date= or
+    ?date_start=/?date_end= (MM/DD/YY, inclusive) cover whole days. Raises
+    ValueError for values that do not parse.
+    """
+    try:
+        start_day, end_day = _day_range_args()
+    except ValueError:
+        raise ValueError("date, date_start and date_end must be MM/DD/YY")
+    start = datetime.strptime(start_day, "%Y-%m-%d") if start_day else None
+    end = datetime.strptime(end_day, "%Y-%m-%d") + timedelta(days=1) if end_day else None
+    try:
+        if request.args.get("start"):
+            start = _parse_iso_timestamp(request.args["start"])[1]
+        if request.args.get("end"):
+            end = _parse_iso_timestamp(request.args["end"])[1]
+    except ValueError:
+        raise ValueError("start and end must be ISO 8601 timestamps")
+    return start, end
+
+
+def _time_range_query(start, end):
+    """Filter on the indexed ``timestamp`` written at ingest."""
     q = {}
+    if start is not None:
+        q["$gte"] = start
+    if end is not None:
+        q["$lt"] = end
+    return {"timestamp": q} if q else {}
 
-    # Date filtering (using your actual field name)
-    date = request.args.get("date")
-    if date:
-        q["Date"] = date
+
+def _build_observation_query():
+    """MongoDB filter for the observation query parameters shared by
+    /api/observations, /api/export and the distribution endpoints.
+    Raises ValueError, with a message for the client, on a bad value."""
+    q = _time_range_query(*_time_range_args())
 
     # Numeric ranges
     def _add_range(field_name, min_arg, max_arg):
         min_v = request.args.get(min_arg)
         max_v = request.args.get(max_arg)
-        if min_v is None and max_v is None:
-            return
         try:
             if min_v is not None:
-                min_f = float(min_v)
-                q.setdefault(field_name, {})["$gte"] = min_f
+                q.setdefault(field_name, {})["$gte"] = float(min_v)
             if max_v is not None:
-                max_f = float(max_v)
-                q.setdefault(field_name, {})["$lte"] = max_f
+                q.setdefault(field_name, {})["$lte"] = float(max_v)
         except ValueError:
-            raise
+            raise ValueError("min/max numeric parameters must be valid numbers")
+
+    _add_range("temperature", "min_temp", "max_temp")
+    _add_range("salinity", "min_sal", "max_sal")
+    _add_range("odo", "min_odo", "max_odo")
+    return q
 
+
+@app.route("/api/observations", methods=["GET"])
+@cached_response
+def get_observations():
+    # Build MongoDB query
     try:
-        _add_range("temperature", "min_temp", "max_temp")
-        _add_range("salinity", "min_sal", "max_sal")
-        _add_range("odo", "min_odo", "max_odo")
-    except ValueError:
-        return jsonify({"error": "min/max numeric parameters must be valid numbers"}), 400
+        q = _build_observation_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Pagination
     try:
@@ -124,94 +604,994 @@ def get_observations():
     
     limit = min(limit, 1000)
 
-    # Query database
+    after = None
+    token = request.args.get("cursor")
+    if token:
+        try:
+            after = _decode_cursor(token)
+        except ValueError:
+            return jsonify({"error": "cursor is not a valid next_cursor token"}), 400
+
+    count_mode = request.args.get("count", "exact").lower()
+    if count_mode not in COUNT_MODES:
+        return jsonify({"error": f"count must be one of: {', '.join(COUNT_MODES)}"}), 400
+
+    layout = _observation_layout()
+    if layout not in OBSERVATION_LAYOUTS:
+        return jsonify({"error": f"format must be one of: {', '.join(OBSERVATION_LAYOUTS)}"}), 400
+    if layout == "arrow" and pa is None:
+        return jsonify({"error": "format=arrow requires pyarrow on the API server"}), 400
+
+    # Query database: the count runs next to the page fetch instead of before it
+    count_future = _query_pool.submit(_count_observations, q, count_mode)
+
+    # One extra document tells us whether there is a next page.
+    items = list(backend.find(q, after=after, skip=skip, limit=limit + 1))
+
     try:
-        total = collection.count_documents(q)
-    except Exception:
-        # In case of a query type mismatch in DB, return 400
+        total, count_type = count_future.result()
+    except OperationFailure as e:
+        if e.timeout:
+            raise
+        # the server rejected the filter for the stored document types
         return jsonify({"error": "Invalid query parameters for stored document types"}), 400
 
-    cursor = collection.find(q, {"_id": 0}).skip(skip).limit(limit)
-    items = list(cursor)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = _encode_cursor(items[-1])
+    for item in items:
+        item.pop("_id", None)
+
+    if layout == "arrow":
+        # Paging metadata travels in headers so the body is a plain Arrow stream
+        response = app.response_class(_arrow_page(items), mimetype=ARROW_MIMETYPE)
+        response.headers["X-Total-Count"] = "" if total is None else str(total)
+        response.headers["X-Count-Type"] = count_type
+        response.headers["X-Next-Cursor"] = next_cursor or ""
+        return response
+    if layout == "columns":
+        return jsonify({"count": total, "count_type": count_type,
+                        "columns": _columns(items), "next_cursor": next_cursor})
+    return jsonify({"count": total, "count_type": count_type, "items": items, "next_cursor": next_cursor})
+
+
+def _observation_layout():
+    """Response layout for /api/observations: ``format`` wins over the Accept header."""
+    fmt = request.args.get("format")
+    if fmt:
+        return fmt.lower()
+    if pa is not None and request.accept_mimetypes.best_match(["application/json", ARROW_MIMETYPE]) == ARROW_MIMETYPE:
+        return "arrow"
+    return "rows"
+
+
+def _columns(items):
+    """Column-oriented layout of a page: field name -> list of values."""
+    names = {}
+    for item in items:
+        names.update(dict.fromkeys(item))
+    return {name: [item.get(name) for item in items] for name in names}
+
+
+def _arrow_page(items):
+    sink = pa.BufferOutputStream()
+    table = next(_arrow_batches([items], None), None) if items else pa.table({})
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+
+#----- Export -----
+# Streams the whole filtered result set straight off the Mongo cursor, one
+# batch at a time, so memory stays flat however many rows match.
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "arrow": (ARROW_MIMETYPE, "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+def _batched(cursor, size):
+    batch = []
+    for doc in cursor:
+        doc.pop("_id", None)
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _export_ndjson(batches, fields):
+    for batch in batches:
+        yield "".join(json.dumps(clean_nan(doc), default=_json_default) + "\n" for doc in batch).encode()
+
+
+def _export_csv(batches, fields):
+    # Without a projection the header comes from the first document; keys
+    # that only appear later are left out.
+    out = io.StringIO()
+    writer = None
+    for batch in batches:
+        if writer is None:
+            writer = csv.DictWriter(out, fieldnames=fields or list(batch[0]), extrasaction="ignore")
+            writer.writeheader()
+        writer.writerows(batch)
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after each batch."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_type(values):
+    """Column type for an export, from the column's values in the first batch.
+
+    Integers are widened to float64 so later fractional values are kept, and
+    all-null, boolean or mixed columns become strings, as for the Parquet
+    dataset main/main.py writes.
+    """
+    try:
+        arrow_type = pa.array(values).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.string()
+    if pa.types.is_integer(arrow_type):
+        return pa.float64()
+    if pa.types.is_null(arrow_type) or pa.types.is_boolean(arrow_type):
+        return pa.string()
+    return arrow_type
+
+
+def _arrow_value(value, arrow_type):
+    """``value`` coerced to ``arrow_type``; None where it does not convert."""
+    if value is None:
+        return None
+    if pa.types.is_floating(arrow_type):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if pa.types.is_timestamp(arrow_type):
+        return value if isinstance(value, datetime) else None
+    if pa.types.is_string(arrow_type):
+        return value if isinstance(value, str) else str(value)
+    return value
+
+
+def _arrow_batches(batches, fields):
+    # The schema is fixed before the first table, from the projection's names
+    # (or the first batch's keys) and the first batch's values, because the
+    # response is already streaming when a later batch arrives. Later batches
+    # are coerced to it; keys only seen later are left out.
+    schema = None
+    for batch in batches:
+        if fields:
+            batch = [{f: doc.get(f) for f in fields} for doc in batch]
+        batch = [{k: (str(v) if isinstance(v, (dict, list, ObjectId)) else v)
+                  for k, v in doc.items()} for doc in batch]
+        if schema is None:
+            names = fields or list(dict.fromkeys(k for doc in batch for k in doc))
+            schema = pa.schema([(name, _arrow_type([doc.get(name) for doc in batch])) for name in names])
+        try:
+            table = pa.Table.from_pylist(batch, schema=schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # a value of another type than the column's: convert value by value
+            table = pa.Table.from_pylist([{f.name: _arrow_value(doc.get(f.name), f.type) for f in schema}
+                                          for doc in batch], schema=schema)
+        yield table
+
+
+def _export_arrow(batches, fields):
+    sink = _ChunkSink()
+    writer = None
+    for table in _arrow_batches(batches, fields):
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
 
-    return jsonify({"count": total, "items": items})
+def _export_parquet(batches, fields):
+    sink = _ChunkSink()
+    writer = None
+    for table in _arrow_batches(batches, fields):
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)  # one row group per batch
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
 
 
+_EXPORT_WRITERS = {
+    "ndjson": _export_ndjson,
+    "csv": _export_csv,
+    "arrow": _export_arrow,
+    "parquet": _export_parquet,
+}
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.route("/api/export", methods=["GET"])
+def export_observations():
+    try:
+        q = _build_observation_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    fmt = request.args.get("format", "ndjson").lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if fmt in ("arrow", "parquet") and pa is None:
+        return jsonify({"error": f"format={fmt} requires pyarrow on the API server"}), 400
+
+    compression = request.args.get("compression", "").lower()
+    if compression not in ("", "gzip"):
+        return jsonify({"error": "compression must be gzip"}), 400
+
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    cursor = backend.find(q, fields or None)
+    body = _EXPORT_WRITERS[fmt](_batched(cursor, EXPORT_BATCH_SIZE), fields)
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"water_quality_data.{extension}"
+    if compression:
+        body = _gzip_stream(body)
+        mimetype = "application/gzip"
+        filename += ".gz"
+
+    response = app.response_class(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
 
 #----- Get Stats -----
-@app.route("/api/stats", methods=["GET"])
-def get_stats():
-    # Get fields from query parameter (comma-separated), default to temperature, salinity, odo
-    fields_param = request.args.get("fields", "temperature,salinity,odo")
-    numeric_fields = [f.strip() for f in fields_param.split(",") if f.strip()]
-    
-    stats = {}
-    
-    for field in numeric_fields:
+PERCENTILES = [25, 50, 75]
+
+# $percentile needs MongoDB 7.0+; flipped off the first time the server rejects it
+_percentile_supported = True
+# "unknown group operator" / InvalidPipelineOperator
+_UNSUPPORTED_OPERATOR_CODES = (15952, 168)
+
+
+def _finite(expr):
+    """Aggregation condition: ``expr`` is a finite number.
+
+    BSON ordering puts null/missing and NaN below every number and strings
+    above them, so the two comparisons also drop non-numeric values.
+    """
+    return {"$and": [{"$gt": [expr, float("-inf")]}, {"$lt": [expr, float("inf")]}]}
+
+
+def _stats_pipeline(fields, with_percentiles, match=None):
+    # project each field to a positional name first: field names may contain
+    # characters that are not allowed in $group output names
+    project = {"_id": 0}
+    group = {"_id": None}
+    for i, field in enumerate(fields):
+        value = f"${field}"
+        project[f"v{i}"] = {"$cond": [_finite(value), value, None]}
+        group[f"count{i}"] = {"$sum": {"$cond": [{"$ne": [f"$v{i}", None]}, 1, 0]}}
+        group[f"mean{i}"] = {"$avg": f"$v{i}"}
+        group[f"sumsq{i}"] = {"$sum": {"$multiply": [f"$v{i}", f"$v{i}"]}}
+        group[f"min{i}"] = {"$min": f"$v{i}"}
+        group[f"max{i}"] = {"$max": f"$v{i}"}
+        if with_percentiles:
+            group[f"pct{i}"] = {"$percentile": {
+                "input": f"$v{i}",
+                "p": [p / 100 for p in PERCENTILES],
+                "method": "approximate",
+            }}
+    pipeline = [{"$project": project}, {"$group": group}]
+    if match:
+        pipeline.insert(0, {"$match": match})
+    return pipeline
+
+
+def _sorted_percentiles(field, count, match=None):
+    """Exact quartiles for servers without $percentile.
+
+    Reads the two neighbouring values of each rank through the field's index
+    (sort + skip) and interpolates linearly, matching numpy.percentile.
+    """
+    finite = {**(match or {}), field: {"$gt": float("-inf"), "$lt": float("inf")}}
+    result = {}
+    for p in PERCENTILES:
+        pos = (count - 1) * p / 100
+        lo = math.floor(pos)
+        values = [doc[field] for doc in collection.find(finite, {"_id": 0, field: 1}).sort(field, 1).skip(lo).limit(2)]
+        if not values:
+            result[str(p)] = None
+            continue
+        upper = values[1] if len(values) > 1 else values[0]
+        result[str(p)] = float(values[0] + (upper - values[0]) * (pos - lo))
+    return result
+
+
+def _field_stats(fields, match=None):
+    """count/mean/min/max/quartiles for every field in one server-side pass."""
+    global _percentile_supported
+    if _percentile_supported:
         try:
-            # Get all values for this field (excluding None/null)
-            cursor = collection.find({field: {"$ne": None, "$exists": True}}, {"_id": 0, field: 1})
-            
-            # Extract values and convert to numeric, filtering out non-numeric values
-            values = []
-            for doc in cursor:
-                if field in doc and doc[field] is not None:
-                    try:
-                        # Try to convert to float
-                        val = float(doc[field])
-                        if not (math.isnan(val) or math.isinf(val)):
-                            values.append(val)
-                    except (ValueError, TypeError):
-                        # Skip non-numeric values
-                        continue
-            
-            if len(values) == 0:
-                stats[field] = {
-                    "count": 0,
-                    "mean": None,
-                    "min": None,
-                    "max": None,
-                    "percentiles": {
-                        "25": None,
-                        "50": None,
-                        "75": None
-                    }
-                }
-            else:
-                values_array = np.array(values)
-                stats[field] = {
-                    "count": len(values),
-                    "mean": float(np.mean(values_array)),
-                    "min": float(np.min(values_array)),
-                    "max": float(np.max(values_array)),
-                    "percentiles": {
-                        "25": float(np.percentile(values_array, 25)),
-                        "50": float(np.percentile(values_array, 50)),
-                        "75": float(np.percentile(values_array, 75))
-                    }
-                }
-        except Exception as e:
-            # If there's an error processing this field, return error info
+            row = next(collection.aggregate(_stats_pipeline(fields, True, match)), {})
+        except OperationFailure as e:
+            if e.code not in _UNSUPPORTED_OPERATOR_CODES:
+                raise
+            _percentile_supported = False
+        except NotImplementedError:
+            # mongomock
+            _percentile_supported = False
+    if not _percentile_supported:
+        row = next(collection.aggregate(_stats_pipeline(fields, False, match)), {})
+
+    stats = {}
+    for i, field in enumerate(fields):
+        count = row.get(f"count{i}", 0)
+        if count == 0:
             stats[field] = {
-                "error": str(e),
                 "count": 0,
                 "mean": None,
+                "stddev": None,
                 "min": None,
-                "max": None
+                "max": None,
+                "percentiles": {str(p): None for p in PERCENTILES}
             }
-    
-    return jsonify(stats)
+            continue
+        if _percentile_supported:
+            percentiles = {str(p): float(v) for p, v in zip(PERCENTILES, row[f"pct{i}"])}
+        else:
+            percentiles = _sorted_percentiles(field, count, match)
+        stats[field] = {
+            "count": count,
+            "mean": float(row[f"mean{i}"]),
+            # population standard deviation from the sum of squares
+            "stddev": math.sqrt(max(row[f"sumsq{i}"] / count - row[f"mean{i}"] ** 2, 0.0)),
+            "min": float(row[f"min{i}"]),
+            "max": float(row[f"max{i}"]),
+            "percentiles": percentiles
+        }
+    return stats
+
+
+_summarized = {"generation": None, "fields": frozenset()}
+
+
+def _summarized_fields():
+    """Fields ingest writes summaries for, re-read once per dataset generation."""
+    generation = _dataset_generation()
+    if _summarized["generation"] != generation:
+        _summarized.update(generation=generation, fields=frozenset(stats_collection.distinct("field")))
+    return _summarized["fields"]
+
+
+def _summary_stats(fields, start_day=None, end_day=None):
+    """Merge the per-date field summaries written by ingest (main/main.py).
+
+    Reads O(dates) small documents instead of scanning the collection:
+    count/mean/M2 are combined exactly and the quartiles are interpolated
+    from the pooled t-digest centroids (exact when every value was kept,
+    see TDIGEST_EXACT in main.py). Fields ingest does not summarize are
+    left out of the result.
+    """
+    summarized = _summarized_fields()
+    wanted = [f for f in fields if f in summarized]
+    if not wanted:
+        return {}
+
+    q = {"field": {"$in": wanted}}
+    if start_day:
+        q.setdefault("day", {})["$gte"] = start_day
+    if end_day:
+        q.setdefault("day", {})["$lte"] = end_day
+
+    docs_by_field = {field: [] for field in wanted}
+    for doc in stats_collection.find(q, {"_id": 0, "field": 1, "count": 1, "mean": 1, "m2": 1,
+                                         "min": 1, "max": 1, "centroids": 1}):
+        docs_by_field[doc["field"]].append(doc)
+
+    result = {}
+    for field, docs in docs_by_field.items():
+        if not docs:
+            result[field] = {
+                "count": 0,
+                "mean": None,
+                "stddev": None,
+                "min": None,
+                "max": None,
+                "percentiles": {str(p): None for p in PERCENTILES}
+            }
+            continue
+        counts = np.array([d["count"] for d in docs], dtype=float)
+        means = np.array([d["mean"] for d in docs], dtype=float)
+        n = counts.sum()
+        mean = float((counts * means).sum() / n)
+        m2 = sum(d["m2"] for d in docs) + float((counts * (means - mean) ** 2).sum())
+        lo = min(d["min"] for d in docs)
+        hi = max(d["max"] for d in docs)
+
+        centroids = np.array([c for d in docs for c in d["centroids"]], dtype=float).reshape(-1, 2)
+        centroids = centroids[np.argsort(centroids[:, 0], kind="mergesort")]
+        if np.all(centroids[:, 1] == 1):
+            # small groups keep every value: the same quartiles as the exact path
+            percentiles = np.percentile(centroids[:, 0], PERCENTILES)
+        else:
+            ranks = np.cumsum(centroids[:, 1]) - centroids[:, 1] / 2
+            x = np.concatenate([[0], ranks, [n]])
+            y = np.concatenate([[lo], centroids[:, 0], [hi]])
+            percentiles = [np.interp(p / 100 * n, x, y) for p in PERCENTILES]
+
+        result[field] = {
+            "count": int(n),
+            "mean": mean,
+            "stddev": math.sqrt(m2 / n),
+            "min": float(lo),
+            "max": float(hi),
+            "percentiles": {str(p): float(v) for p, v in zip(PERCENTILES, percentiles)}
+        }
+    return result
+
+
+def _parse_day(value):
+    """MM/DD/YY (the stored and dashboard date format) -> YYYY-MM-DD."""
+    return datetime.strptime(value, "%m/%d/%y").strftime("%Y-%m-%d")
+
+
+def _day_range_args():
+    """Inclusive (start_day, end_day) from ?date= or ?date_start=/?date_end=.
+
+    Raises ValueError for dates that are not MM/DD/YY.
+    """
+    date = request.args.get("date")
+    if date:
+        day = _parse_day(date)
+        return day, day
+    start = request.args.get("date_start")
+    end = request.args.get("date_end")
+    return (_parse_day(start) if start else None), (_parse_day(end) if end else None)
+
+
+def _dates_in_range(start_day, end_day):
+    """Stored "date" strings whose day falls in [start_day, end_day]."""
+    dates = []
+    for date in collection.distinct("date"):
+        try:
+            day = _parse_day(date)
+        except (TypeError, ValueError):
+            continue
+        if (start_day is None or day >= start_day) and (end_day is None or day <= end_day):
+            dates.append(date)
+    return dates
+
+
+def _invalid_field_names(names):
+    """Requested names MongoDB rejects as field paths ($-prefixed, empty parts or NUL)."""
+    return [name for name in names if name.startswith("$") or "\0" in name or "" in name.split(".")]
+
+
+@app.route("/api/stats", methods=["GET"])
+@cached_response
+def get_stats():
+    # Get fields from query parameter (comma-separated), default to temperature, salinity, odo
+    fields_param = request.args.get("fields", "temperature,salinity,odo")
+    numeric_fields = [f.strip() for f in fields_param.split(",") if f.strip()]
+
+    try:
+        start_day, end_day = _day_range_args()
+    except ValueError:
+        return jsonify({"error": "date, date_start and date_end must be MM/DD/YY"}), 400
+
+    invalid = _invalid_field_names(numeric_fields)
+    if invalid:
+        return jsonify({"error": f"invalid field names: {', '.join(invalid)}"}), 400
+
+    stats, source = backend.field_stats(numeric_fields, start_day, end_day)
+    stats = {field: {k: v for k, v in summary.items() if k != "stddev"} for field, summary in stats.items()}
+
+    response = jsonify(stats)
+    response.headers["X-Stats-Source"] = source
+    return response
+
+#----- Time Series -----
+TIMESERIES_FIELDS = ["temperature", "salinity", "odo", "pH"]
+TIMESERIES_DEFAULT_POINTS = 1000
+TIMESERIES_MAX_POINTS = 10000
+
+
+def _timeseries_pipeline(field, start, end, bucket_seconds):
+    """Bucket ``field`` over [start, end) into fixed-width time buckets inside MongoDB."""
+    return [
+        {"$match": {**_time_range_query(start, end), "$expr": _finite(f"${field}")}},
+        {"$group": {
+            # $subtract of two dates is milliseconds
+            "_id": {"$floor": {"$divide": [{"$subtract": ["$timestamp", start]}, bucket_seconds * 1000]}},
+            "min": {"$min": f"${field}"},
+            "max": {"$max": f"${field}"},
+            "mean": {"$avg": f"${field}"},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def _timestamp_bound(direction):
+    """Earliest (1) or latest (-1) stored timestamp, read off the timestamp index."""
+    doc = collection.find_one({"timestamp": {"$ne": None}}, {"timestamp": 1}, sort=[("timestamp", direction)])
+    return doc["timestamp"] if doc else None
+
+
+@app.route("/api/timeseries", methods=["GET"])
+@mongo_only
+@cached_response
+def get_timeseries():
+    """
+    Downsampled time series for one field: min/max/mean per time bucket.
+
+    Query parameters:
+    - field: temperature, salinity, odo or pH (required)
+    - date or date_start/date_end (MM/DD/YY days), or start/end (ISO 8601):
+      the [start, end) time range (default: all data)
+    - points: target number of buckets (default 1000, max 10000)
+    """
+    field = request.args.get("field")
+    if field not in TIMESERIES_FIELDS:
+        return jsonify({"error": f"field must be one of: {', '.join(TIMESERIES_FIELDS)}"}), 400
+    try:
+        points = int(request.args.get("points", TIMESERIES_DEFAULT_POINTS))
+    except ValueError:
+        return jsonify({"error": "points must be an integer"}), 400
+    if points <= 0:
+        return jsonify({"error": "points must be > 0"}), 400
+    points = min(points, TIMESERIES_MAX_POINTS)
+    try:
+        start, end = _time_range_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # the two open ends are independent index reads
+    first = _query_pool.submit(_timestamp_bound, 1) if start is None else None
+    last = _query_pool.submit(_timestamp_bound, -1) if end is None else None
+    if first is not None:
+        start = first.result()
+    if last is not None:
+        last = last.result()
+        end = last + timedelta(seconds=1) if last is not None else None
+    if start is None or end is None or end <= start:
+        return jsonify({"field": field, "bucket_seconds": None, "points": []})
+    bucket_seconds = max(1, math.ceil((end - start).total_seconds() / points))
+
+    buckets = collection.aggregate(_timeseries_pipeline(field, start, end, bucket_seconds))
+    return jsonify({
+        "field": field,
+        "bucket_seconds": bucket_seconds,
+        "points": [{
+            "t": (start + timedelta(seconds=int(b["_id"]) * bucket_seconds)).isoformat(),
+            "min": b["min"],
+            "max": b["max"],
+            "mean": b["mean"],
+            "count": b["count"],
+        } for b in buckets],
+    })
+
+#----- Distributions -----
+# Histogram bins are counted in MongoDB so the dashboard plots the whole
+# filtered population from a few kilobytes of counts instead of a raw page.
+DISTRIBUTION_FIELDS = ["temperature", "salinity", "odo", "pH", "latitude", "longitude"]
+HISTOGRAM_DEFAULT_BINS = 30
+HIST2D_DEFAULT_BINS = 50
+MAX_BINS = 500
+
+
+def _bins_arg(name, default):
+    bins = int(request.args.get(name, default))
+    if bins <= 0:
+        raise ValueError
+    return min(bins, MAX_BINS)
+
+
+def _bin_index(field, lo, width, bins):
+    """Aggregation expression: bin of ``field`` in [lo, lo + bins*width], the top edge in the last bin."""
+    return {"$min": [{"$floor": {"$divide": [{"$subtract": [f"${field}", lo]}, width]}}, bins - 1]}
+
+
+def _binned_match(q, fields):
+    finite = {"$expr": {"$and": [_finite(f"${f}") for f in fields]}}
+    return {"$and": [q, finite]} if q else finite
+
+
+def _ranges(match, fields):
+    """{field: (min, max)} over the matching documents, or None when nothing matches."""
+    group = {"_id": None}
+    for f in fields:
+        group[f"{f}_min"] = {"$min": f"${f}"}
+        group[f"{f}_max"] = {"$max": f"${f}"}
+    result = list(collection.aggregate([{"$match": match}, {"$group": group}]))
+    if not result or result[0][f"{fields[0]}_min"] is None:
+        return None
+    return {f: (result[0][f"{f}_min"], result[0][f"{f}_max"]) for f in fields}
+
+
+def _edges(lo, hi, bins):
+    """Bin edges and width; a constant field still gets ``bins`` unit-width bins."""
+    width = (hi - lo) / bins if hi > lo else 1.0
+    return [lo + i * width for i in range(bins + 1)], width
+
+
+@app.route("/api/histogram", methods=["GET"])
+@mongo_only
+@cached_response
+def get_histogram():
+    """
+    Histogram of one field over all observations matching the filters.
+
+    Query parameters:
+    - field: temperature, salinity, odo, pH, latitude or longitude (required)
+    - bins: number of equal-width bins (default 30, max 500)
+    - date, min_temp, max_temp, ...: the /api/observations filters
+    """
+    field = request.args.get("field")
+    if field not in DISTRIBUTION_FIELDS:
+        return jsonify({"error": f"field must be one of: {', '.join(DISTRIBUTION_FIELDS)}"}), 400
+    try:
+        bins = _bins_arg("bins", HISTOGRAM_DEFAULT_BINS)
+    except ValueError:
+        return jsonify({"error": "bins must be a positive integer"}), 400
+    try:
+        q = _build_observation_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    match = _binned_match(q, [field])
+    ranges = _ranges(match, [field])
+    if ranges is None:
+        return jsonify({"field": field, "edges": [], "counts": [], "total": 0})
+    edges, width = _edges(*ranges[field], bins)
+
+    counts = [0] * bins
+    for b in collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": _bin_index(field, edges[0], width, bins), "count": {"$sum": 1}}},
+    ]):
+        counts[int(b["_id"])] = b["count"]
+    return jsonify({"field": field, "edges": edges, "counts": counts, "total": sum(counts)})
+
+
+@app.route("/api/hist2d", methods=["GET"])
+@mongo_only
+@cached_response
+def get_hist2d():
+    """
+    2-D histogram of x against y, optionally averaging a third field per cell.
+
+    Query parameters:
+    - x, y: DISTRIBUTION_FIELDS (required)
+    - z: field averaged per cell, e.g. odo (optional)
+    - bins: bins per axis (default 50, max 500); bins_x / bins_y override it
+    - date, min_temp, max_temp, ...: the /api/observations filters
+
+    ``counts`` and ``z_mean`` are indexed [y bin][x bin], ready for a heatmap.
+    """
+    x, y, z = request.args.get("x"), request.args.get("y"), request.args.get("z")
+    for name, value in (("x", x), ("y", y), ("z", z)):
+        if (value is not None or name != "z") and value not in DISTRIBUTION_FIELDS:
+            return jsonify({"error": f"{name} must be one of: {', '.join(DISTRIBUTION_FIELDS)}"}), 400
+    try:
+        bins = _bins_arg("bins", HIST2D_DEFAULT_BINS)
+        bins_x = _bins_arg("bins_x", bins)
+        bins_y = _bins_arg("bins_y", bins)
+    except ValueError:
+        return jsonify({"error": "bins must be a positive integer"}), 400
+    try:
+        q = _build_observation_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    fields = [x, y] + ([z] if z else [])
+    match = _binned_match(q, fields)
+    ranges = _ranges(match, [x, y])
+    if ranges is None:
+        return jsonify({"x": x, "y": y, "z": z, "x_edges": [], "y_edges": [],
+                        "counts": [], "z_mean": [] if z else None, "total": 0})
+    x_edges, x_width = _edges(*ranges[x], bins_x)
+    y_edges, y_width = _edges(*ranges[y], bins_y)
+
+    group = {
+        "_id": {"ix": _bin_index(x, x_edges[0], x_width, bins_x), "iy": _bin_index(y, y_edges[0], y_width, bins_y)},
+        "count": {"$sum": 1},
+    }
+    if z:
+        group["z_mean"] = {"$avg": f"${z}"}
+
+    counts = [[0] * bins_x for _ in range(bins_y)]
+    z_mean = [[None] * bins_x for _ in range(bins_y)] if z else None
+    for cell in collection.aggregate([{"$match": match}, {"$group": group}]):
+        ix, iy = int(cell["_id"]["ix"]), int(cell["_id"]["iy"])
+        counts[iy][ix] = cell["count"]
+        if z:
+            z_mean[iy][ix] = cell["z_mean"]
+    return jsonify({"x": x, "y": y, "z": z, "x_edges": x_edges, "y_edges": y_edges,
+                    "counts": counts, "z_mean": z_mean, "total": sum(map(sum, counts))})
+
+#----- Map Tiles -----
+# Slippy-map tiles precomputed at ingest (see GeoTiles in main/main.py); the
+# map is drawn from at most max_cells merged cells whatever the zoom.
+TILE_ZOOMS = range(4, 23)
+TILE_FIELDS = ["temperature", "salinity", "odo"]
+TILE_DEFAULT_MAX_CELLS = 2000
+TILE_MAX_CELLS = 10000
+
+
+def _tile_xy(lat, lon, zoom):
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _tile_bounds(x, y, zoom):
+    """[west, south, east, north] of a tile in degrees."""
+    n = 2 ** zoom
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return [x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)]
+
+
+def _tile_range(extent, zoom):
+    """Inclusive tile x/y ranges covering extent (west, south, east, north)."""
+    west, south, east, north = extent
+    x0, y0 = _tile_xy(north, west, zoom)
+    x1, y1 = _tile_xy(south, east, zoom)
+    return (x0, x1), (y0, y1)
+
+
+def _data_extent(day_match):
+    """(west, south, east, north) of the tiled data, from the coarsest zoom."""
+    result = list(tiles_collection.aggregate([
+        {"$match": {"zoom": TILE_ZOOMS[0], **day_match}},
+        {"$group": {"_id": None, "west": {"$min": "$lon_min"}, "south": {"$min": "$lat_min"},
+                    "east": {"$max": "$lon_max"}, "north": {"$max": "$lat_max"}}},
+    ]))
+    if not result or result[0]["west"] is None:
+        return None
+    return result[0]["west"], result[0]["south"], result[0]["east"], result[0]["north"]
+
+
+@app.route("/api/tiles", methods=["GET"])
+@mongo_only
+@cached_response
+def get_tiles():
+    """
+    Observation counts and mean temperature/salinity/ODO per map tile.
+
+    Query parameters:
+    - zoom: tile zoom level (default: the finest zoom that fits max_cells)
+    - bbox: west,south,east,north in degrees (default: the whole dataset)
+    - date or date_start/date_end: MM/DD/YY day range
+    - max_cells: most cells to return (default 2000, max 10000)
+    """
+    try:
+        start_day, end_day = _day_range_args()
+    except ValueError:
+        return jsonify({"error": "date, date_start and date_end must be MM/DD/YY"}), 400
+    try:
+        max_cells = min(int(request.args.get("max_cells", TILE_DEFAULT_MAX_CELLS)), TILE_MAX_CELLS)
+        zoom = request.args.get("zoom")
+        zoom = int(zoom) if zoom is not None else None
+        bbox = request.args.get("bbox")
+        bbox = tuple(float(v) for v in bbox.split(",")) if bbox else None
+    except ValueError:
+        return jsonify({"error": "zoom and max_cells must be integers and bbox four numbers"}), 400
+    if max_cells <= 0:
+        return jsonify({"error": "max_cells must be > 0"}), 400
+    if zoom is not None and zoom not in TILE_ZOOMS:
+        return jsonify({"error": f"zoom must be between {TILE_ZOOMS[0]} and {TILE_ZOOMS[-1]}"}), 400
+    if bbox is not None and len(bbox) != 4:
+        return jsonify({"error": "bbox must be west,south,east,north"}), 400
+
+    day_match = {}
+    if start_day or end_day:
+        day_match["day"] = {}
+        if start_day:
+            day_match["day"]["$gte"] = start_day
+        if end_day:
+            day_match["day"]["$lte"] = end_day
+
+    extent = bbox or _data_extent(day_match)
+    if extent is None:
+        return jsonify({"zoom": zoom, "cells": [], "truncated": False})
+    if zoom is None:
+        # finest zoom whose tiles over the extent still fit in max_cells
+        zoom = TILE_ZOOMS[0]
+        for z in TILE_ZOOMS:
+            (x0, x1), (y0, y1) = _tile_range(extent, z)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > max_cells:
+                break
+            zoom = z
+
+    match = {"zoom": zoom, **day_match}
+    if bbox is not None:
+        (x0, x1), (y0, y1) = _tile_range(bbox, zoom)
+        match["x"] = {"$gte": x0, "$lte": x1}
+        match["y"] = {"$gte": y0, "$lte": y1}
+
+    sums = ["count", "lat_sum", "lon_sum"] + [f"{f}_{k}" for f in TILE_FIELDS for k in ("sum", "count")]
+    group = {"_id": {"x": "$x", "y": "$y"}, **{name: {"$sum": f"${name}"} for name in sums}}
+    merged = list(tiles_collection.aggregate([
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {"count": -1}},
+        {"$limit": max_cells + 1},
+    ]))
+
+    cells = []
+    for tile in merged[:max_cells]:
+        x, y = tile["_id"]["x"], tile["_id"]["y"]
+        cell = {
+            "x": x,
+            "y": y,
+            "bounds": _tile_bounds(x, y, zoom),
+            "count": tile["count"],
+            "lat": tile["lat_sum"] / tile["count"],
+            "lon": tile["lon_sum"] / tile["count"],
+        }
+        for f in TILE_FIELDS:
+            n = tile[f"{f}_count"]
+            cell[f] = tile[f"{f}_sum"] / n if n else None
+        cells.append(cell)
+    return jsonify({"zoom": zoom, "cells": cells, "truncated": len(merged) > max_cells})
 
 # ---- Get Outliers ----
+# Both methods reduce to thresholds (lower, upper): |z| > k is the same as a
+# value outside mean -/+ k*stddev, and IQR outliers lie outside q1 - k*iqr /
+# q3 + k*iqr. The thresholds come from the ingest summaries, or else from one
+# aggregation, so no list of values is ever pulled into the API process. The
+# outliers themselves are then one range match on the field's index.
+OUTLIER_CONTEXT_FIELDS = ["latitude", "longitude", "date", "timestamp"]
+OUTLIER_METHODS = ["zscore", "iqr", "rolling"]
+OUTLIER_DEFAULT_K = {"zscore": 3.0, "iqr": 1.5, "rolling": 3.5}
+# method=rolling reads the per-mission rolling median/MAD score stored by main/main.py
+ROLLING_SCORE_FIELDS = {
+    "temperature": "rolling_z_temperature",
+    "salinity": "rolling_z_salinity",
+    "odo": "rolling_z_odo",
+}
+OUTLIER_DEFAULT_LIMIT = 1000
+OUTLIER_MAX_LIMIT = 10000
+
+
+def _outlier_thresholds(field, method, k):
+    """(lower, upper, statistics) for ``method``, or None when ``field`` has no values."""
+    if method == "rolling":
+        # the scores are already standardized per mission, so k is the bound
+        return -k, k, {"score_field": ROLLING_SCORE_FIELDS[field]}
+
+    summary = backend.field_stats([field])[0][field]
+    if not summary["count"]:
+        return None
+    if method == "zscore":
+        avg, stddev = summary["mean"], summary["stddev"]
+        return avg - k * (stddev or 0), avg + k * (stddev or 0), {"mean": avg, "stddev": stddev}
+
+    q1 = summary["percentiles"]["25"]
+    q3 = summary["percentiles"]["75"]
+    iqr = q3 - q1
+    lower_bound = q1 - k * iqr
+    upper_bound = q3 + k * iqr
+    return lower_bound, upper_bound, {
+        "q1": q1,
+        "q3": q3,
+        "iqr": iqr,
+        "lower_bound": lower_bound,
+        "upper_bound": upper_bound
+    }
+
+
+def _outlier_match(field, lower, upper):
+    """Index-bounded match of the values outside [lower, upper].
+
+    The finite outer bounds keep null and NaN (which sort below every number)
+    out of the lower range.
+    """
+    return {"$or": [
+        {field: {"$gt": float("-inf"), "$lt": lower}},
+        {field: {"$gt": upper, "$lt": float("inf")}},
+    ]}
+
+
+def _outlier_fields(field, statistics):
+    # _id stays for the page cursor and is dropped before responding
+    return [field] + [f for f in OUTLIER_CONTEXT_FIELDS if f != field] + \
+        ([statistics["score_field"]] if "score_field" in statistics else [])
+
+
+def _score_outlier(doc, field, method, statistics):
+    """Add the outlier's own score (only matched rows get one) and drop ``_id``."""
+    doc.pop("_id", None)
+    if method == "zscore":
+        doc["z_score"] = (doc[field] - statistics["mean"]) / statistics["stddev"]
+    elif method == "rolling":
+        doc["rolling_z"] = doc.pop(statistics["score_field"], None)
+    return doc
+
+
+def _outlier_page_pipeline(match, fields, after, limit):
+    """Up to ``limit`` outliers in OBSERVATION_SORT order plus the total
+    outlier count, from a single $facet over the range match."""
+    page = [{"$match": _after_cursor(after)}] if after else []
+    page += [
+        {"$sort": {f: 1 for f in OBSERVATION_SORT}},
+        {"$limit": limit},
+        {"$project": {f: 1 for f in fields}},
+    ]
+    return [
+        {"$match": match},
+        {"$facet": {"total": [{"$count": "n"}], "items": page}},
+    ]
+
+
+def _stream_outliers(field, method, statistics, lower, upper, after, limit):
+    fields = _outlier_fields(field, statistics)
+    docs = backend.iter_outliers(statistics.get("score_field", field), lower, upper, fields, after, limit)
+    for doc in docs:
+        doc = _score_outlier(doc, field, method, statistics)
+        yield (json.dumps(clean_nan(doc), default=_json_default) + "\n").encode()
+
+
 @app.route("/api/outliers", methods=["GET"])
+@cached_response
 def get_outliers():
     """
     Detect outliers using either Z-score or IQR method.
     
     Query parameters:
     - field: temperature, salinity, or odo (required)
-    - method: zscore or iqr (default: zscore)
-    - k: threshold value (default: 3.0 for zscore, 1.5 for iqr)
+    - method: zscore, iqr or rolling (default: zscore); rolling flags values
+      far from their own mission's rolling median, scored at ingest
+    - k: threshold value (default: 3.0 for zscore, 1.5 for iqr, 3.5 for rolling)
+    - limit: outliers per page (default 1000, max 10000)
+    - cursor: next_cursor from the previous page
+    - format: json (default) or ndjson, which streams every outlier (or at
+      most ``limit``) one document per line
     """
     # Get parameters
     field = request.args.get("field")
@@ -220,224 +1600,170 @@ def get_outliers():
     # Validate field is provided
     if not field:
         return jsonify({"error": "field parameter is required"}), 400
+    if _invalid_field_names([field]):
+        return jsonify({"error": f"invalid field name: {field}"}), 400
     
     # Validate method
-    if method not in ["zscore", "iqr"]:
-        return jsonify({"error": "method must be 'zscore' or 'iqr'"}), 400
+    if method not in OUTLIER_METHODS:
+        return jsonify({"error": "method must be 'zscore', 'iqr' or 'rolling'"}), 400
+    if method == "rolling" and field not in ROLLING_SCORE_FIELDS:
+        return jsonify({"error": f"method 'rolling' supports: {', '.join(ROLLING_SCORE_FIELDS)}"}), 400
     
     # Get k value with appropriate default
     try:
-        k = float(request.args.get("k", 3.0 if method == "zscore" else 1.5))
+        k = float(request.args.get("k", OUTLIER_DEFAULT_K[method]))
     except ValueError:
         return jsonify({"error": "k must be a valid number"}), 400
-    
+
+    fmt = request.args.get("format", "json").lower()
+    if fmt not in ("json", "ndjson"):
+        return jsonify({"error": "format must be 'json' or 'ndjson'"}), 400
     try:
-        # Calculate statistics for the field
-        pipeline = [
-            {"$match": {field: {"$ne": None, "$exists": True}}},
-            {
-                "$group": {
-                    "_id": None,
-                    "avg": {"$avg": f"${field}"},
-                    "stddev": {"$stdDevPop": f"${field}"}
-                }
-            }
-        ]
-        stats_result = list(collection.aggregate(pipeline))
-        
-        if not stats_result:
-            return jsonify({
-                "count": 0,
-                "outliers": [],
-                "method": method,
-                "field": field,
-                "k": k
-            })
-        
-        avg = stats_result[0]["avg"]
-        stddev = stats_result[0]["stddev"]
-        
-        if method == "zscore":
-            # Z-score method
-            if stddev == 0 or stddev is None:
-                return jsonify({
-                    "count": 0,
-                    "outliers": [],
-                    "method": method,
-                    "field": field,
-                    "k": k,
-                    "message": "Standard deviation is zero, no outliers detected"
-                })
-            
-            # Build projection to avoid duplicate fields
-            projection = {"_id": 0, field: 1, "z_score": 1}
-            # Add standard fields only if they're not the selected field
-            for std_field in ["latitude", "longitude", "date"]:
-                if std_field != field:
-                    projection[std_field] = 1
-            
-            # Find outliers using aggregation pipeline
-            outlier_pipeline = [
-                {"$match": {field: {"$ne": None, "$exists": True}}},
-                {
-                    "$addFields": {
-                        "z_score": {
-                            "$divide": [
-                                {"$subtract": [f"${field}", avg]},
-                                stddev
-                            ]
-                        }
-                    }
-                },
-                {
-                    "$match": {
-                        "$expr": {
-                            "$gt": [
-                                {"$abs": "$z_score"},
-                                k
-                            ]
-                        }
-                    }
-                },
-                {"$project": projection}
-            ]
-            
-        else:  # IQR method
-            # Calculate Q1, Q3 for IQR
-            all_values = list(collection.find(
-                {field: {"$ne": None, "$exists": True}},
-                {field: 1, "_id": 0}
-            ))
-            
-            if not all_values:
-                return jsonify({
-                    "count": 0,
-                    "outliers": [],
-                    "method": method,
-                    "field": field,
-                    "k": k
-                })
-            
-            values = sorted([doc[field] for doc in all_values if doc.get(field) is not None])
-            n = len(values)
-            
-            q1_idx = n // 4
-            q3_idx = (3 * n) // 4
-            
-            q1 = values[q1_idx]
-            q3 = values[q3_idx]
-            iqr = q3 - q1
-            
-            lower_bound = q1 - k * iqr
-            upper_bound = q3 + k * iqr
-            
-            # Build projection to avoid duplicate fields
-            projection = {"_id": 0, field: 1}
-            # Add standard fields only if they're not the selected field
-            for std_field in ["latitude", "longitude", "date"]:
-                if std_field != field:
-                    projection[std_field] = 1
-            
-            # Find outliers
-            outlier_pipeline = [
-                {
-                    "$match": {
-                        field: {"$ne": None, "$exists": True},
-                        "$or": [
-                            {field: {"$lt": lower_bound}},
-                            {field: {"$gt": upper_bound}}
-                        ]
-                    }
-                },
-                {"$project": projection}
-            ]
-        
-        # Execute the pipeline
-        outliers = list(collection.aggregate(outlier_pipeline))
-        outliers = clean_nan(outliers)
-        
+        limit = request.args.get("limit")
+        limit = int(limit) if limit is not None else (OUTLIER_DEFAULT_LIMIT if fmt == "json" else None)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "limit must be > 0"}), 400
+    if fmt == "json":
+        limit = min(limit, OUTLIER_MAX_LIMIT)
+    after = None
+    token = request.args.get("cursor")
+    if token:
+        try:
+            after = _decode_cursor(token)
+        except ValueError:
+            return jsonify({"error": "cursor is not a valid next_cursor token"}), 400
+    
+    thresholds = _outlier_thresholds(field, method, k)
+    if thresholds is None:
         return jsonify({
-            "count": len(outliers),
-            "outliers": outliers,
+            "count": 0,
+            "outliers": [],
+            "method": method,
+            "field": field,
+            "k": k
+        })
+    lower, upper, statistics = thresholds
+
+    if method == "zscore" and not statistics["stddev"]:
+        return jsonify({
+            "count": 0,
+            "outliers": [],
             "method": method,
             "field": field,
             "k": k,
-            "statistics": {
-                "mean": avg,
-                "stddev": stddev
-            } if method == "zscore" else {
-                "q1": q1,
-                "q3": q3,
-                "iqr": iqr,
-                "lower_bound": lower_bound,
-                "upper_bound": upper_bound
-            }
+            "message": "Standard deviation is zero, no outliers detected"
         })
-        
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
-    if not field:
-        return jsonify({"error": "field parameter is required"}), 400
-    
-    if field not in ["temperature", "salinity", "odo"]:
-        return jsonify({"error": "field must be one of: temperature, salinity, odo"}), 400
-    
-    if method not in ["iqr", "z-score"]:
-        return jsonify({"error": "method must be 'iqr' or 'z-score'"}), 400
-    
-    # Get k parameter (threshold multiplier)
-    k_param = request.args.get("k", "1.5")
-    try:
-        k = float(k_param)
-    except ValueError:
-        return jsonify({"error": "k must be a valid number"}), 400
-    
-    # Fetch all documents with the field
-    cursor = collection.find({field: {"$ne": None}}, {"_id": 0})
-    docs = list(cursor)
-    
-    if len(docs) == 0:
-        return jsonify({"count": 0, "outliers": []})
-    
-    # Extract values
-    values = np.array([doc[field] for doc in docs if field in doc and doc[field] is not None])
-    
-    if len(values) == 0:
-        return jsonify({"count": 0, "outliers": []})
-    
-    # Detect outliers based on method
-    outlier_indices = []
-    
-    if method == "iqr":
-        q1 = np.percentile(values, 25)
-        q3 = np.percentile(values, 75)
-        iqr = q3 - q1
-        lower_bound = q1 - k * iqr
-        upper_bound = q3 + k * iqr
-        
-        for i, val in enumerate(values):
-            if val < lower_bound or val > upper_bound:
-                outlier_indices.append(i)
-    
-    elif method == "z-score":
-        mean = np.mean(values)
-        std = np.std(values)
-        
-        if std == 0:
-            # No outliers if no variation
-            return jsonify({"count": 0, "outliers": []})
-        
-        for i, val in enumerate(values):
-            z_score = abs((val - mean) / std)
-            if z_score > k:
-                outlier_indices.append(i)
-    
-    # Get the outlier documents
-    outliers = [docs[i] for i in outlier_indices]
+
+    if fmt == "ndjson":
+        response = app.response_class(_stream_outliers(field, method, statistics, lower, upper, after, limit),
+                                      mimetype="application/x-ndjson")
+        response.headers["X-Outlier-Statistics"] = json.dumps(statistics)
+        return response
+
+    # one extra row tells us whether there is a next page
+    total, outliers = backend.outlier_page(statistics.get("score_field", field), lower, upper,
+                                           _outlier_fields(field, statistics), after, limit + 1)
+    next_cursor = None
+    if len(outliers) > limit:
+        outliers = outliers[:limit]
+        next_cursor = _encode_cursor(outliers[-1])
+    outliers = clean_nan([_score_outlier(outlier, field, method, statistics) for outlier in outliers])
     
-    return jsonify({"count": len(outliers), "outliers": outliers})
+    return jsonify({
+        "count": total,
+        "outliers": outliers,
+        "next_cursor": next_cursor,
+        "method": method,
+        "field": field,
+        "k": k,
+        "statistics": statistics
+    })
+
+
+#----- Batch -----
+# Several GET sub-queries in one round trip. Each runs through the normal
+# routing, validation and response cache inside its own request context, on
+# a pool separate from _query_pool, since the endpoints submit to that one.
+BATCH_MAX_QUERIES = 16
+BATCH_ENDPOINTS = ["dates", "observations", "stats", "outliers", "timeseries", "histogram", "hist2d", "tiles", "health"]
+# response headers passed back with each result
+_BATCH_HEADERS = ["X-Cache", "X-Dataset-Generation", "X-Stats-Source"]
+_batch_pool = ThreadPoolExecutor(max_workers=API_QUERY_WORKERS, thread_name_prefix="api-batch")
+
+
+def _run_subquery(path, params):
+    with app.test_request_context(path, method="GET", query_string=params,
+                                  headers={"Accept": "application/json"}):
+        response = app.full_dispatch_request()
+    return {
+        "status": response.status_code,
+        "body": response.get_json(silent=True),
+        "headers": {h: response.headers[h] for h in _BATCH_HEADERS if h in response.headers},
+    }
+
+
+@app.route("/api/batch", methods=["POST"])
+def batch():
+    """
+    Run several GET queries concurrently and return all their results.
+
+    Body: {"queries": {"<name>": {"path": "observations", "params": {...}}, ...}}
+    where ``path`` is one of BATCH_ENDPOINTS and ``params`` its query
+    parameters. The response is {"results": {"<name>": {"status", "body",
+    "headers"}}}. A failed sub-query only fails its own entry. Sub-queries
+    answer in JSON, so format=arrow and format=ndjson are not available here.
+    """
+    payload = request.get_json(silent=True)
+    queries = payload.get("queries") if isinstance(payload, dict) else None
+    if not isinstance(queries, dict) or not queries:
+        return jsonify({"error": "body must be a JSON object with a non-empty 'queries' object"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"at most {BATCH_MAX_QUERIES} queries per batch"}), 400
+
+    calls = {}
+    for name, query in queries.items():
+        if not isinstance(query, dict):
+            return jsonify({"error": f"query '{name}' must be an object"}), 400
+        endpoint = str(query.get("path", "")).strip("/").removeprefix("api/")
+        if endpoint not in BATCH_ENDPOINTS:
+            return jsonify({"error": f"query '{name}': path must be one of: {', '.join(BATCH_ENDPOINTS)}"}), 400
+        params = query.get("params") or {}
+        if not isinstance(params, dict):
+            return jsonify({"error": f"query '{name}': params must be an object"}), 400
+        if str(params.get("format", "")).lower() in ("arrow", "ndjson"):
+            return jsonify({"error": f"query '{name}': format={params['format']} is not available in a batch"}), 400
+        calls[name] = (f"/api/{endpoint}", params)
+
+    futures = {name: _batch_pool.submit(_run_subquery, path, params) for name, (path, params) in calls.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = {"status": 500, "body": {"error": str(e)}, "headers": {}}
+    return jsonify({"results": results})
+
+
+@app.errorhandler(PyMongoError)
+def database_error(e):
+    # queries that ran past MONGO_TIMEOUT_MS, or found no server or free connection in time
+    if e.timeout:
+        return jsonify({"error": "database query timed out"}), 504
+    return jsonify({"error": str(e)}), 503
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    if API_SERVER == "dev":
+        app.run(host=API_HOST, port=API_PORT, debug=True)
+    else:
+        try:
+            from waitress import serve
+        except ImportError:
+            print("waitress is not installed; falling back to the Flask development server")
+            app.run(host=API_HOST, port=API_PORT, debug=True)
+        else:
+            print(f"Serving on http://{API_HOST}:{API_PORT} with {API_THREADS} threads")
+            serve(app, host=API_HOST, port=API_PORT, threads=API_THREADS,
+                  connection_limit=max(100, API_THREADS * 4), channel_timeout=API_CHANNEL_TIMEOUT)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""Shared fixtures for the API tests.
+
+app.py connects to MongoDB when it is imported, so pymongo.MongoClient is
+pointed at one in-memory mongomock client first and app is imported after.
+"""
+import os
+
+import mongomock
+import pymongo
+import pytest
+
+os.environ.update(API_BACKEND="mongo", MONGODB_URI="test.invalid", MONGO_USER="test", MONGO_PASS="test")
+mongo_client = mongomock.MongoClient()
+pymongo.MongoClient = lambda *args, **kwargs: mongo_client
+
+import app as app_module  # noqa: E402
+
+
+def reset_caches():
+    app_module._response_cache.entries.clear()
+    app_module._count_cache.clear()
+    app_module._generation.update(value=0, checked=0.0)
+    app_module._summarized.update(generation=None, fields=frozenset())
+
+
+@pytest.fixture
+def api():
+    """The app module over empty collections and caches."""
+    # emptied rather than dropped: app holds on to its collection objects
+    for name in mongo_client.list_database_names():
+        for collection in mongo_client[name].list_collection_names():
+            mongo_client[name][collection].delete_many({})
+    reset_caches()
+    yield app_module
+    reset_caches()
+
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
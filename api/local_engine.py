@@ -0,0 +1,391 @@
+"""Read-only query engine over the local column store written by main/main.py.
+
+Runs the API without MongoDB (API_BACKEND=local). Each ingest writes a new
+version of the store under data/columns/ and names it in data/columns/CURRENT.
+A version holds one memory-mapped .npy file per column, with rows sorted by
+(timestamp, load order). A row's number is therefore its position in
+OBSERVATION_SORT order, and it is used as the row's ``_id``:
+
+- numeric columns are float64 with NaN for missing values, and a boolean
+  ``ints`` file flags the rows whose value was an integer
+- ``timestamp`` is datetime64[ms] with NaT
+- string columns are int32 codes into the column's ``categories`` (-1 missing)
+- the API's numeric fields also have an argsort (NaN last) and a count of
+  their non-missing values
+
+Filters are the MongoDB filter documents the API already builds
+(``$and``/``$or`` and ``$eq``/``$ne``/``$gt``/``$gte``/``$lt``/``$lte``/
+``$in``/``$nin`` per field), evaluated as vectorized NumPy masks. A range on
+``timestamp`` first narrows the rows to a slice with a binary search.
+Statistics and outlier ranges read the precomputed sort orders instead of
+sorting.
+"""
+import json
+import math
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+META_FILE = "meta.json"
+CURRENT_FILE = "CURRENT"
+PERCENTILES = [25, 50, 75]
+BATCH_ROWS = 5000  # rows turned into documents at a time
+
+
+class _Store:
+    """One generation of the column store, mapped read-only."""
+
+    def __init__(self, root, meta):
+        self.meta = meta
+        self.generation = meta.get("generation", 0)
+        self.rows = meta.get("rows", 0)
+        self.columns = {}
+        for column in meta.get("columns", []):
+            entry = dict(column)
+            entry["values"] = np.load(os.path.join(root, column["file"]), mmap_mode="r")
+            if "categories" in column:
+                # the trailing None is what code -1 indexes
+                entry["labels"] = np.array(column["categories"] + [None], dtype=object)
+            if "order" in column:
+                entry["order"] = np.load(os.path.join(root, column["order"]), mmap_mode="r")
+            if "ints" in column:
+                entry["ints"] = np.load(os.path.join(root, column["ints"]), mmap_mode="r")
+            self.columns[column["name"]] = entry
+        self.timestamps = None
+        self.first_dated = 0
+        if "timestamp" in self.columns:
+            self.timestamps = self.columns["timestamp"]["values"].view(np.int64)
+            # NaT is the smallest int64, so undated rows sort first
+            self.first_dated = int(np.searchsorted(self.timestamps, np.iinfo(np.int64).min, side="right"))
+        self.sorted_values = {}  # field -> values in argsort order, built on first use
+        self.lock = threading.Lock()
+
+    def sorted_finite(self, field):
+        """(sorted non-missing values, their row numbers) for an ordered field."""
+        column = self.columns[field]
+        with self.lock:
+            if field not in self.sorted_values:
+                rows = np.asarray(column["order"][:column["count"]])
+                self.sorted_values[field] = (np.asarray(column["values"])[rows], rows)
+            return self.sorted_values[field]
+
+
+_EMPTY_META = {"generation": 0, "rows": 0, "columns": [], "dates": []}
+
+
+def _store_dir(base):
+    """Directory of the live version under ``base`` (``base`` itself for a store built before versions), or None."""
+    try:
+        with open(os.path.join(base, CURRENT_FILE)) as f:
+            return os.path.join(base, f.read().strip())
+    except FileNotFoundError:
+        return base if os.path.exists(os.path.join(base, META_FILE)) else None
+
+
+def _to_ms(value):
+    """datetime -> int64 milliseconds on the stored (naive UTC) clock."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "ms").astype(np.int64)
+
+
+class LocalEngine:
+    """The API's storage interface (see MongoBackend in app.py) over the column store.
+
+    The store is re-mapped when ingest publishes a new version. ``generation``
+    checks CURRENT, and requests already running keep the arrays they started
+    with; ingest leaves the version it replaced in place for them.
+    """
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+        self.loaded = None
+        self.store = _Store(root, _EMPTY_META)
+        self._reload()
+        if not self.store.rows:
+            print(f"WARNING: no local column store at {root}; run main/main.py to build it")
+
+    def _reload(self):
+        directory = _store_dir(self.root)
+        if directory is None:
+            return
+        path = os.path.join(directory, META_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if (directory, mtime) == self.loaded:
+            return
+        with open(path) as f:
+            meta = json.load(f)
+        self.store = _Store(directory, meta)
+        self.loaded = (directory, mtime)
+
+    # ----- storage interface -----
+    def generation(self):
+        self._reload()
+        return self.store.generation
+
+    @staticmethod
+    def parse_id(value):
+        return int(value)
+
+    def dates(self):
+        return list(self.store.meta.get("dates", []))
+
+    def count(self, q):
+        store = self.store
+        lo, hi, mask = self._select(store, q)
+        return int(hi - lo if mask is None else np.count_nonzero(mask))
+
+    def estimated_count(self, q):
+        # an exact count is already a vectorized pass over mapped columns
+        return self.count(q)
+
+    def find(self, q, fields=None, after=None, skip=0, limit=None):
+        store = self.store
+        start = after[1] + 1 if after else 0
+        lo, hi, mask = self._select(store, q, start)
+        rows = np.arange(lo, hi) if mask is None else np.flatnonzero(mask) + lo
+        rows = rows[skip:] if limit is None else rows[skip:skip + limit]
+        return self._documents(store, rows, fields)
+
+    def field_stats(self, fields, start_day=None, end_day=None):
+        store = self.store
+        selected = None
+        if start_day or end_day:
+            dates = [d for d in self.dates() if _in_day_range(d, start_day, end_day)]
+            selected = self._select(store, {"date": {"$in": dates}})[2]
+        return {field: self._stats(store, field, selected) for field in fields}, "local"
+
+    def outlier_page(self, field, lower, upper, fields, after=None, limit=None):
+        store = self.store
+        rows = self._outlier_rows(store, field, lower, upper)
+        total = len(rows)
+        return total, list(self._documents(store, _page(rows, after, limit), fields))
+
+    def iter_outliers(self, field, lower, upper, fields, after=None, limit=None):
+        store = self.store
+        rows = self._outlier_rows(store, field, lower, upper)
+        return self._documents(store, _page(rows, after, limit), fields)
+
+    # ----- internals -----
+    def _select(self, store, q, start=0):
+        """(lo, hi, mask) where ``mask`` marks matches in rows [lo, hi); mask None means all of them."""
+        lo, hi = start, store.rows
+        rest = dict(q)
+        bounds = q.get("timestamp")
+        if (store.timestamps is not None and isinstance(bounds, dict) and bounds
+                and all(op in _RANGE_SIDES and isinstance(v, datetime) for op, v in bounds.items())):
+            # rows are in timestamp order, so a time range is a slice
+            del rest["timestamp"]
+            lo = max(lo, store.first_dated)
+            for op, value in bounds.items():
+                position = int(np.searchsorted(store.timestamps, _to_ms(value), side=_RANGE_SIDES[op]))
+                if op in ("$gt", "$gte"):
+                    lo = max(lo, position)
+                else:
+                    hi = min(hi, position)
+        if hi <= lo:
+            return lo, lo, np.zeros(0, dtype=bool)
+        if not rest:
+            return lo, hi, None
+        return lo, hi, self._match(store, rest, lo, hi)
+
+    def _match(self, store, q, lo, hi):
+        mask = np.ones(hi - lo, dtype=bool)
+        for key, cond in q.items():
+            if key == "$and":
+                for sub in cond:
+                    mask &= self._match(store, sub, lo, hi)
+            elif key == "$or":
+                any_mask = np.zeros(hi - lo, dtype=bool)
+                for sub in cond:
+                    any_mask |= self._match(store, sub, lo, hi)
+                mask &= any_mask
+            elif isinstance(cond, dict) and cond and all(op.startswith("$") for op in cond):
+                for op, value in cond.items():
+                    mask &= self._compare(store, key, op, value, lo, hi)
+            else:
+                mask &= self._compare(store, key, "$eq", cond, lo, hi)
+        return mask
+
+    def _compare(self, store, field, op, value, lo, hi):
+        if op not in _OPERATORS:
+            raise ValueError(f"unsupported filter operator {op} for the local backend")
+        n = hi - lo
+        if field == "_id":
+            values = np.arange(lo, hi)
+            missing = np.zeros(n, dtype=bool)
+        else:
+            column = store.columns.get(field)
+            if column is None:
+                # a missing field only ever equals null
+                matches_null = (op == "$eq" and value is None) or (op == "$ne" and value is not None)
+                return np.full(n, matches_null)
+            values = column["values"][lo:hi]
+            kind = column["kind"]
+            if kind == "str":
+                return self._compare_labels(column, values, op, value)
+            if kind == "time":
+                missing = np.isnat(values)
+                values = values.view(np.int64)
+                value = ([_to_ms(v) if v is not None else None for v in value] if op in ("$in", "$nin")
+                         else _to_ms(value) if isinstance(value, datetime) else value)
+            else:
+                missing = np.isnan(values)
+
+        if op in ("$in", "$nin"):
+            wanted = [v for v in value if v is not None and _is_number(v)]
+            result = np.isin(values, wanted) & ~missing
+            if any(v is None for v in value):
+                result |= missing
+            return result if op == "$in" else ~result
+        if value is None:
+            # null matches missing values; ordered comparisons with null match nothing
+            if op == "$eq":
+                return missing
+            if op == "$ne":
+                return ~missing
+            return missing if op in ("$gte", "$lte") else np.zeros(n, dtype=bool)
+        if not _is_number(value):
+            return np.full(n, op == "$ne")
+        with np.errstate(invalid="ignore"):
+            result = _OPERATORS[op](values, value)
+        if op == "$ne":
+            result |= missing
+        return result
+
+    @staticmethod
+    def _compare_labels(column, codes, op, value):
+        # evaluate once per category, then look every row's code up
+        labels = column["labels"]
+        if op in ("$in", "$nin"):
+            hits = np.array([label in value for label in labels])
+            hits = hits if op == "$in" else ~hits
+        elif op == "$eq":
+            hits = labels == value if value is not None else np.array([label is None for label in labels])
+        elif op == "$ne":
+            hits = labels != value if value is not None else np.array([label is not None for label in labels])
+        elif value is None or not isinstance(value, str):
+            hits = np.zeros(len(labels), dtype=bool)
+        else:
+            hits = np.array([label is not None and _OPERATORS[op](label, value) for label in labels])
+        return np.asarray(hits, dtype=bool)[codes]
+
+    def _documents(self, store, rows, fields=None):
+        names = [f for f in (fields or store.columns) if f in store.columns]
+        for start in range(0, len(rows), BATCH_ROWS):
+            part = rows[start:start + BATCH_ROWS]
+            values = {name: self._values(store.columns[name], part) for name in names}
+            for i, row in enumerate(part.tolist()):
+                doc = {"_id": row}
+                for name in names:
+                    doc[name] = values[name][i]
+                yield doc
+
+    @staticmethod
+    def _values(column, rows):
+        values = column["values"][rows]
+        if column["kind"] == "str":
+            return column["labels"][values].tolist()
+        if column["kind"] == "time":
+            return values.astype(object).tolist()  # NaT becomes None
+        values = [None if math.isnan(v) else v for v in values.tolist()]
+        if "ints" in column:
+            for i in np.flatnonzero(column["ints"][rows]).tolist():
+                values[i] = int(values[i])
+        return values
+
+    def _stats(self, store, field, selected=None):
+        empty = {"count": 0, "mean": None, "stddev": None, "min": None, "max": None,
+                 "percentiles": {str(p): None for p in PERCENTILES}}
+        column = store.columns.get(field)
+        if column is None or column["kind"] != "float":
+            return empty
+        values = column["values"]
+        if "order" in column:
+            ordered, order_rows = store.sorted_finite(field)
+            if selected is not None:
+                ordered = ordered[selected[order_rows]]
+        else:
+            ordered = np.asarray(values if selected is None else values[selected])
+            ordered = np.sort(ordered[~np.isnan(ordered)])
+        ordered = ordered[np.isfinite(ordered)]
+        count = len(ordered)
+        if not count:
+            return empty
+        percentiles = {}
+        for p in PERCENTILES:
+            # linear interpolation between neighbouring ranks, as numpy.percentile
+            pos = (count - 1) * p / 100
+            i = math.floor(pos)
+            upper = ordered[min(i + 1, count - 1)]
+            percentiles[str(p)] = float(ordered[i] + (upper - ordered[i]) * (pos - i))
+        return {
+            "count": count,
+            "mean": float(ordered.mean()),
+            "stddev": float(ordered.std()),
+            "min": float(ordered[0]),
+            "max": float(ordered[-1]),
+            "percentiles": percentiles,
+        }
+
+    def _outlier_rows(self, store, field, lower, upper):
+        """Row numbers, ascending, of the finite values below ``lower`` or above ``upper``."""
+        column = store.columns.get(field)
+        if column is None or column["kind"] != "float":
+            return np.zeros(0, dtype=np.int64)
+        if "order" in column:
+            ordered, order_rows = store.sorted_finite(field)
+        else:
+            values = np.asarray(column["values"])
+            order_rows = np.flatnonzero(~np.isnan(values))
+            order_rows = order_rows[np.argsort(values[order_rows], kind="stable")]
+            ordered = values[order_rows]
+        first = np.searchsorted(ordered, -np.inf, side="right")
+        below = np.searchsorted(ordered, lower, side="left")
+        above = np.searchsorted(ordered, upper, side="right")
+        last = np.searchsorted(ordered, np.inf, side="left")
+        rows = np.concatenate([order_rows[first:max(first, below)], order_rows[min(above, last):last]])
+        return np.sort(rows)
+
+
+_OPERATORS = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+    "$in": None,
+    "$nin": None,
+}
+
+
+# searchsorted side that puts each bound's position just past the excluded rows
+_RANGE_SIDES = {"$gt": "right", "$gte": "left", "$lt": "left", "$lte": "right"}
+
+
+def _page(rows, after, limit):
+    """Rows past the ``after`` cursor, at most ``limit`` of them."""
+    if after:
+        rows = rows[np.searchsorted(rows, after[1], side="right"):]
+    return rows if limit is None else rows[:limit]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+
+def _in_day_range(date, start_day, end_day):
+    """Whether a stored MM/DD/YY date falls in the inclusive YYYY-MM-DD range."""
+    try:
+        day = datetime.strptime(date, "%m/%d/%y").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return False
+    return (start_day is None or day >= start_day) and (end_day is None or day <= end_day)
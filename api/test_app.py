@@ -0,0 +1,316 @@
+import base64
+import io
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, ExecutionTimeout
+
+
+def test_arrow_batches_widen_the_first_batch_schema(api):
+    pa = pytest.importorskip("pyarrow")
+    batches = [
+        [{"odo": 1, "note": None, "flag": True}],  # int and all-null columns first
+        [{"odo": 1.5, "note": 2.0, "flag": False}],
+        [{"odo": "n/a", "note": "text", "extra": 1}],
+    ]
+    table = pa.concat_tables(api._arrow_batches(batches, None))
+    assert table.schema.field("odo").type == pa.float64()
+    assert table.schema.field("note").type == pa.string()
+    assert table.column("odo").to_pylist() == [1.0, 1.5, None]
+    assert table.column("note").to_pylist() == [None, "2.0", "text"]
+    assert table.column("flag").to_pylist() == ["True", "False", None]
+    assert table.column_names == ["odo", "note", "flag"]
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_export_keeps_values_after_the_first_batch(api, client, monkeypatch, fmt):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    monkeypatch.setattr(api, "EXPORT_BATCH_SIZE", 2)
+    api.collection.insert_many([
+        {"temperature": 25, "salinity": None},
+        {"temperature": 26, "salinity": None},
+        {"temperature": 26.5, "salinity": 35.25},
+        {"temperature": 27, "salinity": 36.0},
+    ])
+
+    response = client.get(f"/api/export?format={fmt}&fields=temperature,salinity")
+    assert response.status_code == 200
+    body = io.BytesIO(response.get_data())
+    table = pa.ipc.open_stream(body).read_all() if fmt == "arrow" else pq.read_table(body)
+    assert table.column("temperature").to_pylist() == [25.0, 26.0, 26.5, 27.0]
+    assert table.column("salinity").to_pylist() == [None, None, "35.25", "36.0"]
+
+
+def _insert_timestamps(api, *stamps):
+    api.collection.insert_many([
+        {"timestamp": datetime.fromisoformat(s), "temperature": float(i)} for i, s in enumerate(stamps)
+    ])
+
+
+@pytest.mark.parametrize("query", [
+    "start=2022-10-07T00:00:00Z",
+    "start=2022-10-07T02:00:00%2B02:00&end=2022-10-08T00:00:00Z",
+])
+def test_timeseries_accepts_bounds_with_an_offset(api, client, query):
+    _insert_timestamps(api, "2022-10-06T23:00:00", "2022-10-07T00:00:00", "2022-10-07T12:00:00")
+    response = client.get(f"/api/timeseries?field=temperature&points=10&{query}")
+    assert response.status_code == 200
+    points = response.get_json()["points"]
+    assert sum(p["count"] for p in points) == 2
+    assert points[0]["t"] == "2022-10-07T00:00:00"
+
+
+def test_observations_accept_bounds_with_an_offset(api, client):
+    _insert_timestamps(api, "2022-10-06T23:00:00", "2022-10-07T00:00:00", "2022-10-07T12:00:00")
+    response = client.get("/api/observations?start=2022-10-07T00:00:00Z&end=2022-10-07T13:00:00%2B01:00")
+    assert response.status_code == 200
+    assert [o["temperature"] for o in response.get_json()["items"]] == [1.0]
+
+
+def test_summary_quartiles_are_exact_when_every_value_was_kept(api, client):
+    days = {"2022-10-07": [12.0, 12.5, 13.0, 19.17, 38.0], "2022-11-16": [38.2, 38.24, 46.0, 46.35, 47.0]}
+    for day, values in days.items():
+        api.stats_collection.insert_one({
+            "source_file": "a.csv", "date": day, "day": day, "field": "salinity", "rows": len(values),
+            "count": len(values), "mean": float(np.mean(values)), "m2": float(np.var(values) * len(values)),
+            "min": min(values), "max": max(values), "centroids": [[v, 1.0] for v in values],
+        })
+    response = client.get("/api/stats?fields=salinity")
+    assert response.headers["X-Stats-Source"] == "summary"
+    everything = [v for values in days.values() for v in values]
+    expected = np.percentile(everything, [25, 50, 75])
+    assert list(response.get_json()["salinity"]["percentiles"].values()) == pytest.approx(list(expected))
+
+
+def _count(client, query):
+    body = client.get(f"/api/observations?{query}").get_json()
+    return body["count"], body["count_type"]
+
+
+def test_estimated_count_without_a_filter_uses_collection_metadata(api, client, monkeypatch):
+    api.collection.insert_many([{"temperature": float(i)} for i in range(3)])
+    monkeypatch.setattr(api.collection, "estimated_document_count", lambda: 99)
+    assert _count(client, "count=estimated") == (99, "estimated")
+    assert _count(client, "count=exact") == (3, "exact")
+
+
+def test_estimated_count_for_whole_days_uses_the_summary_rows(api, client):
+    _insert_timestamps(api, "2022-10-07T08:00:00", "2022-10-07T09:00:00", "2022-10-08T08:00:00")
+    api.stats_collection.insert_many([
+        # one summary per field; each carries the rows of its (source file, date)
+        {"source_file": "a.csv", "date": "10/07/22", "day": "2022-10-07", "field": field, "rows": 5}
+        for field in ("temperature", "salinity")
+    ] + [
+        {"source_file": "b.csv", "date": "10/07/22", "day": "2022-10-07", "field": "temperature", "rows": 7},
+        {"source_file": "a.csv", "date": "10/08/22", "day": "2022-10-08", "field": "temperature", "rows": 11},
+    ])
+    assert _count(client, "count=estimated&date=10/07/22") == (12, "estimated")
+    assert _count(client, "count=estimated&date_start=10/07/22&date_end=10/08/22") == (23, "estimated")
+
+
+@pytest.mark.parametrize("query", [
+    "min_temp=0.5",  # not a pure time range
+    "start=2022-10-07T08:30:00",  # does not start at midnight
+    "date=10/09/22",  # no summaries for that day
+])
+def test_estimated_count_falls_back_to_an_exact_count(api, client, query):
+    _insert_timestamps(api, "2022-10-07T08:00:00", "2022-10-07T09:00:00", "2022-10-08T08:00:00")
+    expected = client.get(f"/api/observations?count=exact&{query}").get_json()["count"]
+    assert _count(client, f"count=estimated&{query}") == (expected, "exact")
+
+
+def test_cached_count_is_reused_for_the_same_filter(api, client):
+    _insert_timestamps(api, "2022-10-07T08:00:00", "2022-10-07T09:00:00")
+    assert _count(client, "count=cached&min_temp=0&limit=1") == (2, "exact")
+    # another page of the same filter misses the response cache but not the count cache
+    assert _count(client, "count=cached&min_temp=0&limit=2") == (2, "cached")
+    assert _count(client, "count=cached&min_temp=1&limit=2") == (1, "exact")
+
+
+def test_count_none_and_unknown_modes(api, client):
+    _insert_timestamps(api, "2022-10-07T08:00:00")
+    assert _count(client, "count=none") == (None, "none")
+    response = client.get("/api/observations?count=bogus")
+    assert response.status_code == 400
+    assert "count must be one of" in response.get_json()["error"]
+
+
+def test_cursor_round_trip(api):
+    doc = {"_id": ObjectId(), "timestamp": datetime(2022, 10, 7, 12, 30, 5)}
+    assert api._decode_cursor(api._encode_cursor(doc)) == [doc["timestamp"], doc["_id"]]
+    undated = {"_id": ObjectId(), "timestamp": None}
+    assert api._decode_cursor(api._encode_cursor(undated)) == [None, undated["_id"]]
+
+
+@pytest.mark.parametrize("values", [
+    None,
+    ["2022-10-07T12:30:05"],
+    ["not a time", "6350d0c0f0f0f0f0f0f0f0f0"],
+    ["2022-10-07T12:30:05", "not an id"],
+    {"timestamp": "2022-10-07T12:30:05", "_id": "6350d0c0f0f0f0f0f0f0f0f0"},
+])
+def test_tampered_cursors_are_rejected(api, client, values):
+    token = base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+    for bad in (token, token[:-3], "%%%not-base64"):
+        with pytest.raises(ValueError):
+            api._decode_cursor(bad)
+    response = client.get(f"/api/observations?cursor={token}")
+    assert response.status_code == 400
+
+
+def test_cursor_pages_through_equal_timestamps(api, client):
+    same = datetime(2022, 10, 7, 12, 0, 0)
+    stamps = [None, same, same, same, same + timedelta(seconds=1), same, None]
+    api.collection.insert_many([{"timestamp": t, "temperature": float(i)} for i, t in enumerate(stamps)])
+
+    seen = []
+    url = "/api/observations?limit=2&count=none"
+    while True:
+        body = client.get(url).get_json()
+        seen.extend(item["temperature"] for item in body["items"])
+        if not body["next_cursor"]:
+            break
+        url = f"/api/observations?limit=2&count=none&cursor={body['next_cursor']}"
+    everything = client.get("/api/observations?limit=100&count=none").get_json()["items"]
+    assert seen == [item["temperature"] for item in everything]
+    assert sorted(seen) == [float(i) for i in range(len(stamps))]
+
+
+def test_cursor_continues_after_a_skipped_page(api, client):
+    start = datetime(2022, 10, 7, 12, 0, 0)
+    api.collection.insert_many([{"timestamp": start + timedelta(seconds=i), "temperature": float(i)}
+                                for i in range(40)])
+    first = client.get("/api/observations?limit=10&skip=10&count=none").get_json()
+    assert [item["temperature"] for item in first["items"]] == [float(i) for i in range(10, 20)]
+
+    # the cursor already encodes the offset: the dashboard drops skip once it has one
+    cursor = first["next_cursor"]
+    following = client.get(f"/api/observations?limit=10&count=none&cursor={cursor}").get_json()
+    assert [item["temperature"] for item in following["items"]] == [float(i) for i in range(20, 30)]
+    skipped = client.get(f"/api/observations?limit=10&skip=10&count=none&cursor={cursor}").get_json()
+    assert [item["temperature"] for item in skipped["items"]] == [float(i) for i in range(30, 40)]
+
+
+def test_response_cache_expires_and_evicts(api, monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr(api.time, "time", lambda: now[0])
+    cache = api.ResponseCache(max_entries=2, ttl=60)
+    for key in ("a", "b"):
+        cache.set(key, 1, (200, {}, key.encode()))
+    assert cache.get("a") == (200, {}, b"a")  # "b" is now the least recently used
+    cache.set("c", 1, (200, {}, b"c"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    now[0] += 61
+    assert cache.get("a") is None and cache.get("c") is None
+
+    # processes sharing a disk cache see each other's entries until they expire
+    path = str(tmp_path / "responses.sqlite")
+    writer, reader = api.ResponseCache(2, 60, path), api.ResponseCache(2, 60, path)
+    writer.set("d", 1, (200, {"Content-Type": "application/json"}, b"{}"))
+    assert reader.get("d") == (200, {"Content-Type": "application/json"}, b"{}")
+    now[0] += 61
+    assert api.ResponseCache(2, 60, path).get("d") is None
+
+
+def test_etag_revalidation_and_generation_change(api, client):
+    api.collection.insert_one({"date": "10/07/22", "temperature": 1.0})
+    first = client.get("/api/dates")
+    etag = first.headers["ETag"]
+    assert first.headers["X-Cache"] == "MISS"
+    assert client.get("/api/dates").headers["X-Cache"] == "HIT"
+
+    revalidated = client.get("/api/dates", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b""
+
+    api.meta_collection.update_one({"_id": api.collection.name}, {"$set": {"generation": 1}}, upsert=True)
+    api._generation.update(checked=0.0)
+    changed = client.get("/api/dates", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.headers["X-Dataset-Generation"] == "1"
+
+
+@pytest.mark.parametrize("url", ["/api/dates", "/api/stats?fields=temperature", "/api/outliers?field=temperature"])
+@pytest.mark.parametrize("error, status", [
+    (ExecutionTimeout("operation exceeded time limit", 50), 504),
+    (AutoReconnect("connection closed"), 503),
+])
+def test_database_errors_reach_the_error_handler(api, client, monkeypatch, url, error, status):
+    def fail(*args, **kwargs):
+        raise error
+    for method in ("dates", "field_stats", "outlier_page"):
+        monkeypatch.setattr(api.backend, method, fail)
+    monkeypatch.setattr(api, "_outlier_thresholds", fail)
+    assert client.get(url).status_code == status
+
+
+@pytest.mark.parametrize("url", ["/api/stats?fields=temperature,$where", "/api/outliers?field=a..b"])
+def test_invalid_field_names_are_rejected(api, client, url):
+    assert client.get(url).status_code == 400
+
+
+def _batch(client, queries):
+    return client.post("/api/batch", json={"queries": queries})
+
+
+@pytest.mark.parametrize("queries", [
+    {"a": {"path": "export"}},
+    {"a": {"path": "../admin"}},
+    {"a": {"path": "observations", "params": {"format": "arrow"}}},
+    {"a": {"path": "outliers", "params": {"field": "odo", "format": "NDJSON"}}},
+    {"a": {"path": "observations", "params": ["limit", 1]}},
+    {"a": "observations"},
+    {},
+])
+def test_batch_rejects_invalid_queries(api, client, queries):
+    response = _batch(client, queries)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_batch_limits_the_number_of_queries(api, client):
+    queries = {f"q{i}": {"path": "dates"} for i in range(api.BATCH_MAX_QUERIES + 1)}
+    assert _batch(client, queries).status_code == 400
+    queries.popitem()
+    assert _batch(client, queries).status_code == 200
+
+
+def test_batch_failures_stay_in_their_own_entry(api, client, monkeypatch):
+    _insert_timestamps(api, "2022-10-07T08:00:00", "2022-10-07T09:00:00")
+
+    def fail(*args, **kwargs):
+        raise AutoReconnect("connection closed")
+    monkeypatch.setattr(api.backend, "field_stats", fail)
+    monkeypatch.setattr(api.backend, "dates", lambda: 1 / 0)
+    results = _batch(client, {
+        "page": {"path": "/api/observations", "params": {"limit": 1, "count": "exact"}},
+        "bad_limit": {"path": "observations", "params": {"limit": "many"}},
+        "stats": {"path": "stats", "params": {"fields": "temperature"}},
+        "dates": {"path": "dates"},
+    }).get_json()["results"]
+    assert results["page"]["status"] == 200 and results["page"]["body"]["count"] == 2
+    assert results["bad_limit"]["status"] == 400
+    assert results["stats"]["status"] == 503
+    assert results["dates"]["status"] == 500
+
+
+def test_batch_results_carry_the_cache_headers(api, client):
+    _insert_timestamps(api, "2022-10-07T08:00:00")
+    queries = {"dates": {"path": "dates"}, "stats": {"path": "stats", "params": {"fields": "temperature"}}}
+    first = _batch(client, queries).get_json()["results"]
+    second = _batch(client, queries).get_json()["results"]
+    for name in queries:
+        assert first[name]["headers"]["X-Cache"] == "MISS"
+        assert second[name]["headers"]["X-Cache"] == "HIT"
+        assert second[name]["headers"]["X-Dataset-Generation"] == first[name]["headers"]["X-Dataset-Generation"]
+        assert second[name]["body"] == first[name]["body"]
+    assert "X-Stats-Source" in first["stats"]["headers"]
+    # sub-queries ask for JSON, and share those cache entries with direct requests that do
+    assert client.get("/api/dates", headers={"Accept": "application/json"}).headers["X-Cache"] == "HIT"
@@ -0,0 +1,119 @@
+"""The local backend answers like MongoDB over the same ingest run."""
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+from conftest import reset_caches
+from local_engine import LocalEngine
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO, "main"))
+import main  # noqa: E402
+
+SAMPLE_FILES = [os.path.join(REPO, "data", name) for name in ("2021-oct21.csv", "2022-nov16.csv")]
+
+PARITY_URLS = [
+    "/api/dates",
+    "/api/observations?limit=1000",
+    "/api/observations?limit=50&min_temp=28&date=10/21/21&fields=temperature,Batt Percent",
+    "/api/observations?limit=20&date_start=11/16/22&date_end=11/16/22&format=columns",
+    "/api/stats?fields=temperature,salinity,odo,pH",
+    "/api/stats?fields=temperature,salinity&date=11/16/22",
+    "/api/outliers?field=salinity&method=iqr&limit=500",
+    "/api/outliers?field=odo&method=zscore&limit=500",
+    "/api/outliers?field=temperature&method=rolling&limit=500",
+]
+
+
+def ingest(api, files):
+    """A full run of ``files`` with the options in sys.argv."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.run_full(main.parse_args(), files, None, None, None, None, api.collection)
+
+
+@pytest.fixture
+def store(api, tmp_path, monkeypatch):
+    """Ingest the sample files into MongoDB and, with --local-store, the local store under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["main.py", "--local-store"])
+    ingest(api, SAMPLE_FILES)
+    return str(tmp_path / main.LOCAL_STORE_DIR)
+
+
+def test_local_store_is_opt_in(api, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    ingest(api, SAMPLE_FILES[:1])
+    assert not os.path.exists(main.LOCAL_STORE_DIR)
+
+
+def normalized(value):
+    """JSON body with ids and cursors dropped, floats rounded and ints told apart from floats."""
+    if isinstance(value, dict):
+        return {k: normalized(v) for k, v in value.items() if k not in ("_id", "next_cursor")}
+    if isinstance(value, list):
+        return [normalized(v) for v in value]
+    if isinstance(value, float):
+        return "float", float(f"{value:.12g}")
+    if isinstance(value, int) and not isinstance(value, bool):
+        return "int", value
+    return value
+
+
+def test_local_backend_matches_mongo(api, client, store, monkeypatch):
+    local = LocalEngine(store)
+    for url in PARITY_URLS:
+        bodies = []
+        for backend in (api.backend, local):
+            monkeypatch.setattr(api, "backend", backend)
+            reset_caches()
+            response = client.get(url)
+            assert response.status_code == 200, url
+            bodies.append(normalized(response.get_json()))
+        assert bodies[0] == bodies[1], url
+
+
+def test_local_backend_keeps_integer_fields(api, client, store, monkeypatch):
+    monkeypatch.setattr(api, "backend", LocalEngine(store))
+    item = client.get("/api/observations?limit=1").get_json()["items"][0]
+    assert isinstance(item["Batt Percent"], int)
+    assert isinstance(item["temperature"], float)
+
+
+def test_new_versions_leave_the_mapped_one_in_place(api, store):
+    engine = LocalEngine(store)
+    first = main.local_store_dir(store)
+    generation = engine.generation()
+
+    ingest(api, SAMPLE_FILES[:1])
+    second = main.local_store_dir(store)
+    assert second != first and os.path.isdir(first)  # still mapped by engine.store
+    assert engine.generation() == generation + 1
+    assert engine.count({}) == api.collection.count_documents({})
+
+    ingest(api, SAMPLE_FILES[:1])
+    assert not os.path.exists(first)
+    assert sorted(os.listdir(store)) == sorted([main.LOCAL_CURRENT_FILE, os.path.basename(second),
+                                                os.path.basename(main.local_store_dir(store))])
+
+
+def test_cursor_paging_matches_mongo(api, client, store, monkeypatch):
+    first_page = "/api/observations?limit=37&count=none&fields=timestamp,temperature,source_file"
+    pages = []
+    for backend in (api.backend, LocalEngine(store)):
+        monkeypatch.setattr(api, "backend", backend)
+        reset_caches()
+        rows = []
+        url = first_page
+        while url:
+            body = client.get(url).get_json()
+            rows.extend(normalized(body["items"]))
+            url = f"{first_page}&cursor={body['next_cursor']}" if body["next_cursor"] else None
+        pages.append(rows)
+    timestamps = [row["timestamp"] for row in pages[0]]
+    assert len(timestamps) > len(set(timestamps))  # pages break inside runs of equal timestamps
+    assert pages[0] == pages[1]
+    assert len(pages[0]) == api.collection.count_documents({})
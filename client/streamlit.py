@@ -3,7 +3,12 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import requests
+from requests.adapters import HTTPAdapter
+import json
 import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # Page config
@@ -11,6 +16,105 @@ st.set_page_config(page_title="Water Quality Dashboard", layout="wide")
 
 # API base URL
 API_BASE = "http://127.0.0.1:5000/api"
+# Cached batch responses are reused for this long, and only while the API
+# reports the same dataset generation (polled every GENERATION_TTL seconds)
+CACHE_TTL = 300
+GENERATION_TTL = 10
+PREFETCH_PENDING_MAX = 8
+
+
+@st.cache_resource
+def http_session():
+    """One pooled keep-alive session shared by every rerun and browser tab."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def prefetcher():
+    """Background pool, the in-flight prefetches keyed like fetch_batch, and
+    the lock guarding them; every session's script thread shares the dict."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch"), OrderedDict(), threading.Lock()
+
+
+def post_batch(queries_json):
+    response = http_session().post(f"{API_BASE}/batch", data=queries_json,
+                                   headers={"Content-Type": "application/json"}, timeout=50)
+    response.raise_for_status()
+    return response.json()["results"]
+
+
+@st.cache_data(ttl=GENERATION_TTL, show_spinner=False)
+def dataset_generation():
+    try:
+        return http_session().get(f"{API_BASE}/health", timeout=5).json().get("dataset_generation")
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+
+class BatchServerError(Exception):
+    """A batch with a 5xx sub-result; raised so st.cache_data does not keep it."""
+
+    def __init__(self, results):
+        super().__init__("the API failed some queries of the batch")
+        self.results = results
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False, max_entries=256)
+def fetch_batch(queries_json, generation):
+    """Results of one /api/batch body; generation is only part of the cache key.
+
+    Raises BatchServerError, carrying the results, when any query failed
+    on the server, so a transient error is retried on the next rerun.
+    """
+    _, pending, lock = prefetcher()
+    with lock:
+        future = pending.pop((queries_json, generation), None)
+    results = None
+    if future is not None:
+        try:
+            results = future.result()
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            pass  # fetch it again in the foreground and report that error instead
+    if results is None:
+        results = post_batch(queries_json)
+    if any((result or {}).get("status", 500) >= 500 for result in results.values()):
+        raise BatchServerError(results)
+    return results
+
+
+def prefetch_batch(queries_json, generation):
+    executor, pending, lock = prefetcher()
+    key = (queries_json, generation)
+    with lock:
+        if key in pending:
+            return
+        while len(pending) >= PREFETCH_PENDING_MAX:
+            pending.popitem(last=False)
+        pending[key] = executor.submit(post_batch, queries_json)
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def dataset_days(generation):
+    """First and last day with data, from /api/dates (MM/DD/YY); None when there is none."""
+    response = http_session().get(f"{API_BASE}/dates", timeout=10)
+    response.raise_for_status()
+    days = [datetime.strptime(d, "%m/%d/%y").date() for d in response.json()["dates"]]
+    return (min(days), max(days)) if days else None
+
+
+def batch_body(queries):
+    return json.dumps({"queries": queries}, sort_keys=True)
+
+
+def page_params(params, cursor):
+    """params for the page after ``cursor``; the API applies skip after the
+    cursor, and the cursor already encodes the offset, so skip is dropped."""
+    return {**{k: v for k, v in params.items() if k != "skip"}, "cursor": cursor}
+
 
 # Title
 st.title("🌊 Water Quality Data Dashboard")
@@ -18,21 +122,20 @@ st.title("🌊 Water Quality Data Dashboard")
 # Sidebar Controls
 st.sidebar.title("Control Panel")
 
-# Probe server for available fields by fetching a single observation
+# Replaced by the fields of a single unfiltered observation once the batch below returns
 available_fields = ["temperature", "salinity", "odo", "date"]
-try:
-    probe = requests.get(f"{API_BASE}/observations", params={"limit": 1}, timeout=5)
-    if probe.status_code == 200:
-        probe_items = probe.json().get("items", [])
-        if probe_items:
-            available_fields = sorted(list(probe_items[0].keys()))
-except Exception:
-    pass
 
 # Date filtering
 st.sidebar.subheader("Date Filter")
 date_mode = st.sidebar.radio("Mode", ["Single Date", "Date Range"], index=1, key="date_mode")
 
+generation = dataset_generation()
+# The range defaults to the whole dataset, so the first view shows data
+try:
+    data_days = dataset_days(generation)
+except (requests.exceptions.RequestException, ValueError, KeyError):
+    data_days = None
+
 # Initialize filter variables
 date_filter = None
 single_date = None
@@ -47,7 +150,7 @@ if date_mode == "Single Date":
 elif date_mode == "Date Range":
     date_range = st.sidebar.date_input(
         "Select start and end dates", 
-        value=(datetime.today() - timedelta(days=7), datetime.today()), 
+        value=data_days or (datetime.today() - timedelta(days=7), datetime.today()),
         key="date_range"
     )
     if len(date_range) == 2:
@@ -76,10 +179,15 @@ limit = st.sidebar.slider("Limit", min_value=100, max_value=1000, value=100, ste
 # Ensure a session_state key for pagination exists before creating widgets
 if "skip" not in st.session_state:
     st.session_state["skip"] = 0
+# Pages are navigated with the API's next_cursor tokens: "cursors" holds the
+# cursor of every page visited since the last jump (None = first page)
+if "cursors" not in st.session_state:
+    st.session_state["cursors"] = [None]
 
 def _on_skip_input_changed():
     # Copy the widget value into the canonical skip session key
     st.session_state["skip"] = int(st.session_state.get("skip_input", 0))
+    st.session_state["cursors"] = [None]
 
 # Manual Skip input (safe key 'skip_input'); step by page size for convenience
 skip_input = st.sidebar.number_input(
@@ -115,7 +223,9 @@ else:
     st.info("**No filters applied** - Showing all data")
 
 # Build query parameters
-params = {"limit": limit, "skip": skip}
+# count=cached: the API memoizes the exact total per filter set, so paging
+# through the same result set doesn't recount it every time
+params = {"limit": limit, "skip": skip, "count": "cached"}
 if date_mode == "Single Date" and single_date is not None:
     params["date"] = single_date.strftime("%m/%d/%y")
 elif date_mode == "Date Range" and start_date is not None and end_date is not None:
@@ -135,40 +245,106 @@ if odo_min is not None:
 if odo_max is not None:
     params["max_odo"] = odo_max
 
+# Start over from the first page whenever the filters or page size change
+query_key = tuple(sorted((k, str(v)) for k, v in params.items()))
+if st.session_state.get("query_key") != query_key:
+    st.session_state["query_key"] = query_key
+    st.session_state["cursors"] = [None]
+if st.session_state["cursors"][-1] is not None:
+    params = page_params(params, st.session_state["cursors"][-1])
+
+# Everything this rerun shows comes from one /api/batch round trip; the API
+# runs the queries concurrently. Chart queries cover every matching row.
+dist_params = {k: v for k, v in params.items() if k not in ("limit", "skip", "cursor", "count")}
+day_params = {k: v for k, v in params.items() if k in ("date", "date_start", "date_end")}
+queries = {
+    "fields": {"path": "observations", "params": {"limit": 1, "count": "none", "format": "columns"}},
+    "page": {"path": "observations", "params": {**params, "format": "columns"}},
+    "timeseries": {"path": "timeseries", "params": {**day_params, "field": "temperature", "points": 1500}},
+    "histogram": {"path": "histogram", "params": {**dist_params, "field": "salinity", "bins": 30}},
+    "hist2d": {"path": "hist2d", "params": {**dist_params, "x": "temperature", "y": "salinity", "z": "odo", "bins": 60}},
+    "tiles": {"path": "tiles", "params": day_params},
+}
+# Widgets further down keep last run's values in session state
+stats_fields = st.session_state.get("stats_fields", ["temperature", "salinity", "odo"])
+if stats_fields:
+    queries["stats"] = {"path": "stats", "params": {"fields": ",".join(stats_fields)}}
+outlier_params = None
+if st.session_state.get("detect_outliers_btn") and "outlier_field" in st.session_state:
+    outlier_method = st.session_state.get("outlier_method", "zscore")
+    outlier_params = {"field": st.session_state["outlier_field"], "method": outlier_method,
+                      "k": st.session_state.get("outlier_k", {"zscore": 3.0, "iqr": 1.5, "rolling": 3.5}[outlier_method])}
+    queries["outliers"] = {"path": "outliers", "params": outlier_params}
+
+batch_error = None
+try:
+    results = fetch_batch(batch_body(queries), generation)
+except BatchServerError as e:
+    results = e.results  # shown as usual, just not cached
+except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+    batch_error = e
+    results = {}
+
+
+def batch_result(name):
+    """(status code, JSON body) of one query from this rerun's batch."""
+    result = results.get(name) or {}
+    return result.get("status"), result.get("body") or {}
+
+
+fields_status, fields_body = batch_result("fields")
+if fields_status == 200 and fields_body.get("columns"):
+    available_fields = sorted(fields_body["columns"])
+
 # Debug info (helps verify pagination behavior)
 with st.sidebar.expander("Debug (request params)", expanded=False):
     st.write("limit:", limit)
     st.write("skip (session):", st.session_state.get("skip"))
+    st.write("page cursors:", len(st.session_state["cursors"]))
     st.write("params:", params)
 
-# Fetch data from API
-try:
-    response = requests.get(f"{API_BASE}/observations", params=params, timeout=50)
-    
-    if response.status_code == 200:
-        data = response.json()
-        items = data.get("items", [])
-        total_count = data.get("count", 0)
+# Observations page
+page_status, data = batch_result("page")
+if batch_error is not None:
+    st.error(f"Failed to connect to API: {batch_error}")
+    st.info("Make sure your Flask API is running at http://127.0.0.1:5000")
+else:
+    if page_status == 200:
+        page_df = pd.DataFrame(data.get("columns", {}))
+        total_count = data.get("count") or 0
         
         # Display counts and pagination
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Total Matching Records", total_count)
+            st.metric("Total Matching Records", total_count, help=f"{data.get('count_type', 'exact')} count")
         with col2:
-            st.metric("Returned Records", len(items))
+            st.metric("Returned Records", len(page_df))
+
+        next_cursor = data.get("next_cursor")
+        if next_cursor:
+            # Warm the batch the "Next ▶" rerun will send (buttons reset, so
+            # no outlier query) while this page is being read
+            next_queries = {k: v for k, v in queries.items() if k != "outliers"}
+            next_queries["page"] = {"path": "observations",
+                                    "params": page_params(queries["page"]["params"], next_cursor)}
+            prefetch_batch(batch_body(next_queries), generation)
 
         # Compute pagination
         total_pages = math.ceil(total_count / limit) if limit > 0 else 1
-        current_page = (skip // limit) + 1 if limit > 0 else 1
+        current_page = (skip // limit) + len(st.session_state["cursors"]) if limit > 0 else 1
         with col3:
             st.metric("Page", f"{current_page} / {total_pages}")
 
         # Prev / Next buttons for navigation using callbacks (no experimental_rerun)
         def go_prev(limit_val=limit):
-            st.session_state["skip"] = max(0, st.session_state.get("skip", 0) - limit_val)
+            if len(st.session_state["cursors"]) > 1:
+                st.session_state["cursors"].pop()
+            else:
+                st.session_state["skip"] = max(0, st.session_state.get("skip", 0) - limit_val)
 
-        def go_next(limit_val=limit, total_pages_val=total_pages):
-            st.session_state["skip"] = min(max(0, (total_pages_val - 1) * limit_val), st.session_state.get("skip", 0) + limit_val)
+        def go_next(next_cursor_val=next_cursor):
+            if next_cursor_val:
+                st.session_state["cursors"].append(next_cursor_val)
 
         nav_col1, nav_col2 = st.columns([1, 1])
         with nav_col1:
@@ -176,8 +352,8 @@ try:
         with nav_col2:
             st.button("Next ▶", on_click=go_next)
         
-        if items:
-            df = pd.DataFrame(items)
+        if not page_df.empty:
+            df = page_df
             
             # Keep original date format, create datetime column for sorting/plotting
             if "date" in df.columns:
@@ -210,6 +386,12 @@ try:
                 file_name="water_quality_data.csv",
                 mime="text/csv"
             )
+            # The page download above only covers the rows on screen; the
+            # export endpoint streams every row matching the filters.
+            export_params = {k: v for k, v in params.items() if k not in ("limit", "skip", "cursor", "count")}
+            export_params["format"] = "csv"
+            export_url = requests.Request("GET", f"{API_BASE}/export", params=export_params).prepare().url
+            st.link_button("Download All Matching Rows as CSV", export_url)
             
             # Visualizations
             st.subheader("Visualizations")
@@ -218,8 +400,25 @@ try:
             tab1, tab2, tab3, tab4 = st.tabs(["Temperature Over Time", "Salinity Distribution", "Temp vs Salinity", "Map View"])
             
             with tab1:
-                # Line chart - Temperature over time
-                if "temperature" in df.columns and "date_dt" in df.columns:
+                # Whole selected date range, downsampled by the API to min/max/mean buckets
+                ts_status, ts_body = batch_result("timeseries")
+                ts_points = ts_body.get("points", []) if ts_status == 200 else []
+                if ts_points:
+                    ts_df = pd.DataFrame(ts_points)
+                    ts_df["t"] = pd.to_datetime(ts_df["t"])
+                    fig1 = go.Figure([
+                        go.Scatter(x=ts_df["t"], y=ts_df["max"], mode="lines", line=dict(width=0),
+                                   name="max", showlegend=False),
+                        go.Scatter(x=ts_df["t"], y=ts_df["min"], mode="lines", line=dict(width=0),
+                                   fill="tonexty", fillcolor="rgba(255,107,107,0.25)", name="min–max"),
+                        go.Scatter(x=ts_df["t"], y=ts_df["mean"], mode="lines", line=dict(color="#FF6B6B"),
+                                   name="mean"),
+                    ])
+                    fig1.update_layout(title="Temperature Over Time", xaxis_title="Date",
+                                       yaxis_title="Temperature (°C)")
+                    st.plotly_chart(fig1, use_container_width=True)
+                # Line chart - Temperature over time (current page only)
+                elif "temperature" in df.columns and "date_dt" in df.columns:
                     # Sort by datetime for proper time series
                     df_sorted = df.dropna(subset=["date_dt"]).sort_values("date_dt")
                     if len(df_sorted) > 0:
@@ -241,9 +440,20 @@ try:
                 else:
                     st.warning("Temperature data not available")
             
+            # Distribution charts are binned by the API over every row matching the filters
             with tab2:
                 # Histogram - Salinity distribution
-                if "salinity" in df.columns:
+                hist_status, hist = batch_result("histogram")
+                hist = hist if hist_status == 200 else {}
+                if hist.get("counts"):
+                    edges = hist["edges"]
+                    fig2 = go.Figure(go.Bar(x=[(a + b) / 2 for a, b in zip(edges, edges[1:])],
+                                            y=hist["counts"], width=edges[1] - edges[0],
+                                            marker_color='#4ECDC4'))
+                    fig2.update_layout(title="Salinity Distribution", xaxis_title="Salinity (ppt)",
+                                       yaxis_title="Frequency", bargap=0)
+                    st.plotly_chart(fig2, use_container_width=True)
+                elif "salinity" in df.columns:
                     fig2 = px.histogram(df, x="salinity", nbins=30,
                                        title="Salinity Distribution",
                                        labels={"salinity": "Salinity (ppt)", "count": "Frequency"})
@@ -253,8 +463,22 @@ try:
                     st.warning("Salinity data not available")
             
             with tab3:
-                # Scatter plot - Temperature vs Salinity colored by ODO
-                if all(col in df.columns for col in ["temperature", "salinity", "odo"]):
+                # Binned Temperature vs Salinity, each cell colored by its mean ODO
+                grid_status, grid = batch_result("hist2d")
+                grid = grid if grid_status == 200 else {}
+                if grid.get("total"):
+                    x_edges, y_edges = grid["x_edges"], grid["y_edges"]
+                    fig3 = go.Figure(go.Heatmap(
+                        x=[(a + b) / 2 for a, b in zip(x_edges, x_edges[1:])],
+                        y=[(a + b) / 2 for a, b in zip(y_edges, y_edges[1:])],
+                        z=grid["z_mean"], customdata=grid["counts"], colorscale="Viridis",
+                        colorbar=dict(title="ODO (mg/L)"),
+                        hovertemplate="Temp %{x:.2f} °C<br>Salinity %{y:.2f} ppt<br>"
+                                      "Mean ODO %{z:.2f}<br>Rows %{customdata}<extra></extra>"))
+                    fig3.update_layout(title="Temperature vs Salinity (colored by mean ODO)",
+                                       xaxis_title="Temperature (°C)", yaxis_title="Salinity (ppt)")
+                    st.plotly_chart(fig3, use_container_width=True)
+                elif all(col in df.columns for col in ["temperature", "salinity", "odo"]):
                     fig3 = px.scatter(df, x="temperature", y="salinity", color="odo",
                                      title="Temperature vs Salinity (colored by ODO)",
                                      labels={"temperature": "Temperature (°C)", 
@@ -266,8 +490,21 @@ try:
                     st.warning("Required data not available for scatter plot")
             
             with tab4:
-                # Map view
-                if all(col in df.columns for col in ["latitude", "longitude"]):
+                # Map view from per-tile aggregates: a bounded number of cells
+                # however many observations fall in the selected dates
+                tile_status, tile_body = batch_result("tiles")
+                cells = tile_body.get("cells", []) if tile_status == 200 else []
+                if cells:
+                    cells_df = pd.DataFrame(cells)
+                    fig4 = px.scatter_mapbox(cells_df, lat="lat", lon="lon", size="count",
+                                            hover_data=["count", "temperature", "salinity", "odo"],
+                                            color="temperature",
+                                            size_max=25,
+                                            zoom=14,
+                                            title="Observation Locations (mean per map cell)")
+                    fig4.update_layout(mapbox_style="open-street-map")
+                    st.plotly_chart(fig4, use_container_width=True)
+                elif all(col in df.columns for col in ["latitude", "longitude"]):
                     fig4 = px.scatter_mapbox(df, lat="latitude", lon="longitude",
                                             hover_data=["temperature", "salinity", "odo", "date"],
                                             color="temperature",
@@ -283,24 +520,22 @@ try:
             st.warning("No observations found with the current filters.")
     
     else:
-        st.error(f"API request failed with status code {response.status_code}")
-        st.write("Response:", response.text)
-
-except requests.exceptions.RequestException as e:
-    st.error(f"Failed to connect to API: {e}")
-    st.info("Make sure your Flask API is running at http://127.0.0.1:5000")
+        st.error(f"API request failed with status code {page_status}")
+        st.write("Response:", data)
 
 # Statistics Panel
 st.divider()
 st.subheader("Summary Statistics")
 
 # Let the user choose which fields to show stats for
-stats_fields = st.multiselect("Fields for summary statistics", options=available_fields, default=[f for f in ["temperature", "salinity", "odo"] if f in available_fields])
+shown_stats_fields = st.multiselect("Fields for summary statistics", options=available_fields, default=[f for f in ["temperature", "salinity", "odo"] if f in available_fields], key="stats_fields")
+if shown_stats_fields != stats_fields:
+    # changed since the batch was built; fetched by the next rerun
+    st.rerun()
 if stats_fields:
     try:
-        stats_response = requests.get(f"{API_BASE}/stats", params={"fields": ",".join(stats_fields)}, timeout=50)
-        if stats_response.status_code == 200:
-            stats = stats_response.json()
+        stats_status, stats = batch_result("stats")
+        if stats_status == 200:
             cols = st.columns(len(stats_fields))
             for i, field in enumerate(stats_fields):
                 with cols[i]:
@@ -330,21 +565,26 @@ col1, col2, col3 = st.columns(3)
 with col1:
     outlier_field = st.selectbox("Field", options=available_fields, index=available_fields.index("temperature") if "temperature" in available_fields else 0, key="outlier_field")
 with col2:
-    outlier_method = st.selectbox("Method", ["zscore", "iqr"], key="outlier_method")
+    # rolling: distance from the mission's own rolling median, in robust standard deviations
+    outlier_method = st.selectbox("Method", ["zscore", "iqr", "rolling"], key="outlier_method")
 with col3:
-    outlier_k = st.number_input("K value", value=3.0 if outlier_method == "zscore" else 1.5, step=0.1, format="%.2f", key="outlier_k")
+    outlier_k = st.number_input("K value", value={"zscore": 3.0, "iqr": 1.5, "rolling": 3.5}[outlier_method], step=0.1, format="%.2f", key="outlier_k")
 
-if st.button("Detect Outliers", key="detect_outliers_btn"):
+if st.button("Detect Outliers", key="detect_outliers_btn") and outlier_params is not None:
     try:
-        outlier_params = {"field": outlier_field, "method": outlier_method, "k": outlier_k}
-        outlier_response = requests.get(f"{API_BASE}/outliers", params=outlier_params, timeout=50)
+        outlier_status, outlier_data = batch_result("outliers")
         
-        if outlier_response.status_code == 200:
-            outlier_data = outlier_response.json()
+        if outlier_status == 200:
             outlier_count = outlier_data.get("count", 0)
             outliers = outlier_data.get("outliers", [])
             
             st.metric("Outliers Found", outlier_count)
+            if outlier_data.get("next_cursor"):
+                # the API pages outliers; the full set streams as NDJSON
+                st.caption(f"Showing the first {len(outliers)} outliers.")
+                full_url = requests.Request("GET", f"{API_BASE}/outliers",
+                                            params={**outlier_params, "format": "ndjson"}).prepare().url
+                st.link_button("Download All Outliers (NDJSON)", full_url)
             
             # Show statistics used for detection
             if "statistics" in outlier_data:
@@ -363,6 +603,8 @@ if st.button("Detect Outliers", key="detect_outliers_btn"):
                 display_cols = [outlier_field, "latitude", "longitude", "date"]
                 if outlier_method == "zscore" and "z_score" in outlier_df.columns:
                     display_cols.append("z_score")
+                if outlier_method == "rolling" and "rolling_z" in outlier_df.columns:
+                    display_cols.append("rolling_z")
                 available = [col for col in display_cols if col in outlier_df.columns]
                 st.dataframe(outlier_df[available], use_container_width=True)
                 
@@ -378,11 +620,7 @@ if st.button("Detect Outliers", key="detect_outliers_btn"):
             else:
                 st.success("No outliers detected with current parameters!")
         else:
-            st.error(f"Failed to fetch outliers: Status {outlier_response.status_code}")
-            try:
-                error_data = outlier_response.json()
-                st.error(f"Error: {error_data.get('error', 'Unknown error')}")
-            except:
-                st.error(f"Response: {outlier_response.text}")
+            st.error(f"Failed to fetch outliers: Status {outlier_status}")
+            st.error(f"Error: {outlier_data.get('error', 'Unknown error')}")
     except Exception as e:
         st.error(f"Error detecting outliers: {type(e).__name__}: {e}")
\ No newline at end of file
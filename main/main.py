@@ -2,137 +2,1579 @@ import pandas as pd
 import numpy as np
 import pymongo
 from dotenv import load_dotenv
+import argparse
+import hashlib
+import json
 import os
 import glob
-import os
+import re
+import shutil
+import time
+import warnings
+from collections import deque
+from datetime import datetime, timezone
+from itertools import groupby, islice, repeat
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import Manager
 from pymongo.errors import BulkWriteError
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the Parquet copy of the cleaned data is optional
+    pa = None
+    pq = None
 
-# -------- Load and Combine CSV Files --------
-# Look for source CSVs in several possible locations. Some copies of the
-# project put source CSVs in `source_data/`, others under `data/source_data/`.
-candidates = [
-    os.path.join("data", "source_data", "*.csv"),
-    os.path.join("source_data", "*.csv"),
-    os.path.join("data", "*.csv"),
-]
 
-csv_files = []
-for pattern in candidates:
-    found = glob.glob(pattern)
-    if found:
-        csv_files.extend(found)
+# columns to z-score
+NUMERIC_COLS = ["Temperature (c)", "Salinity (ppt)", "ODO mg/L"]
 
-# Deduplicate and normalize
-csv_files = sorted(list(dict.fromkeys(csv_files)))
+THRESH = 3.0
 
-if not csv_files:
-    print("No source CSV files found. Looked in:")
-    for p in candidates:
-        print(f"  - {p}")
-    print("Place your input CSV files in one of the above locations (for example: data/source_data/) and re-run the script.")
-    raise SystemExit(1)
+# Columns the streaming reader keeps (everything the API and dashboard use)
+# and the dtypes they are parsed with, so no ~70-column object frames are built.
+STREAM_COLS = ["Latitude", "Longitude", "Date", "Time", "Time hh:mm:ss", "pH"] + NUMERIC_COLS
+STREAM_DTYPES = {
+    "Latitude": "float64",
+    "Longitude": "float64",
+    "Date": str,
+    "Time": str,
+    "Time hh:mm:ss": str,
+    "pH": "float64",
+    **{col: "float64" for col in NUMERIC_COLS},
+}
 
-df_list = [pd.read_csv(f) for f in csv_files]
-df = pd.concat(df_list, ignore_index=True)
+OUTPUT_DIR = "data"
+OUTPUT_PATH = os.path.join(OUTPUT_DIR, "cleaned.csv")
+PARQUET_DIR = os.path.join(OUTPUT_DIR, "cleaned")
 
 
-# print("Columns in dataset:")
-# print(df.columns.tolist())
+def parse_args():
+    parser = argparse.ArgumentParser(description="Clean ASV CSV exports and load them into MongoDB.")
+    parser.add_argument("--stream", action="store_true",
+                        help="read each file in bounded chunks and keep only the columns the pipeline uses")
+    parser.add_argument("--chunksize", type=int, default=50_000,
+                        help="rows per chunk in --stream mode (default: 50000)")
+    parser.add_argument("--all-columns", action="store_true",
+                        help="in --stream mode, keep every source column instead of STREAM_COLS")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only ingest new or changed files, tracked in the ingest manifest")
+    parser.add_argument("--swap", action="store_true",
+                        help="rebuild into a staging collection and rename it over the live one when complete")
+    parser.add_argument("--check-indexes", action="store_true",
+                        help="report whether every index in INDEX_SPEC exists on the collection, then exit")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parse and clean files across N processes (default: 1, serial)")
+    parser.add_argument("--batch-size", type=int, default=5000,
+                        help="documents per insert_many batch (default: 5000)")
+    parser.add_argument("--writers", type=int, default=4,
+                        help="concurrent MongoDB writer threads (default: 4)")
+    parser.add_argument("--local-store", action="store_true",
+                        help="also build the memory-mapped column store for API_BACKEND=local; later runs "
+                             "keep an existing store up to date (its build holds whole columns in memory)")
+    parser.add_argument("--outlier-mode", choices=["global", "rolling"], default="global",
+                        help="drop rows by the global z-score (default) or by the per-mission rolling "
+                             "median/MAD score; keep one mode across --incremental runs")
+    args = parser.parse_args()
+    if args.chunksize <= 0:
+        parser.error("--chunksize must be > 0")
+    if args.workers <= 0:
+        parser.error("--workers must be > 0")
+    if args.swap and args.incremental:
+        parser.error("--swap rebuilds the whole collection and cannot be combined with --incremental")
+    if args.batch_size <= 0:
+        parser.error("--batch-size must be > 0")
+    if args.writers <= 0:
+        parser.error("--writers must be > 0")
+    return args
 
-print("Loaded files:", [os.path.basename(f) for f in csv_files])
-print("Total rows:", len(df))
-print(df.head())
 
+# -------- Locate Source CSV Files --------
+def find_csv_files():
+    # Look for source CSVs in several possible locations. Some copies of the
+    # project put source CSVs in `source_data/`, others under `data/source_data/`.
+    candidates = [
+        os.path.join("data", "source_data", "*.csv"),
+        os.path.join("source_data", "*.csv"),
+        os.path.join("data", "*.csv"),
+    ]
 
-# columns to z-score
-NUMERIC_COLS = ["Temperature (c)", "Salinity (ppt)", "ODO mg/L"]
+    csv_files = []
+    for pattern in candidates:
+        found = glob.glob(pattern)
+        if found:
+            csv_files.extend(found)
 
-# ensure numeric (non-numeric -> NaN)
-df[NUMERIC_COLS] = df[NUMERIC_COLS].apply(pd.to_numeric, errors="coerce")
+    # Deduplicate and normalize; never read our own output back in as a source
+    csv_files = sorted(list(dict.fromkeys(csv_files)))
+    csv_files = [f for f in csv_files if os.path.abspath(f) != os.path.abspath(OUTPUT_PATH)]
 
-# compute z-scores across the whole combined dataset
-means = df[NUMERIC_COLS].mean()
-stds = df[NUMERIC_COLS].std(ddof=0) 
-stds = stds.replace(0, np.nan) # avoid divide-by-zero
-z = (df[NUMERIC_COLS] - means) / stds
+    if not csv_files:
+        print("No source CSV files found. Looked in:")
+        for p in candidates:
+            print(f"  - {p}")
+        print("Place your input CSV files in one of the above locations (for example: data/source_data/) and re-run the script.")
+        raise SystemExit(1)
 
-THRESH = 3.0
-is_outlier = (z.abs() > THRESH).any(axis=1)
+    return csv_files
 
-# report
-total_rows = len(df)
-removed_rows = int(is_outlier.sum())
-remaining_rows = total_rows - removed_rows
 
-print("=== Cleaning Report ===")
-print(f"Total rows originally:          {total_rows}")
-print(f"Rows removed as outliers:       {removed_rows}")
-print(f"Rows remaining after cleaning:  {remaining_rows}")
+def read_chunks(path, columns=None, chunksize=None, lenient=False):
+    """Yield DataFrames from one source CSV.
 
-# drop outliers
-df_clean = df.loc[~is_outlier].copy()
-df_clean = df_clean.dropna(subset=NUMERIC_COLS)
+    ``columns=None`` keeps every column; otherwise only ``columns`` are parsed
+    with ``STREAM_DTYPES``. ``lenient`` drops the float dtypes for files whose
+    numeric columns contain junk (those are coerced later instead).
+    """
+    kwargs = {}
+    if columns is not None:
+        wanted = set(columns)
+        kwargs["usecols"] = lambda c: c in wanted
+        kwargs["dtype"] = {c: t for c, t in STREAM_DTYPES.items()
+                           if c in wanted and not (lenient and t == "float64")}
+    if chunksize is None:
+        yield pd.read_csv(path, **kwargs)
+        return
+    with pd.read_csv(path, chunksize=chunksize, **kwargs) as reader:
+        yield from reader
 
-output_dir = "data"
-os.makedirs(output_dir, exist_ok=True)  # create folder if it doesn't exist
 
-output_path = os.path.join(output_dir, "cleaned.csv")
-df_clean.to_csv(output_path, index=False)
-print(f"Cleaned data saved to {output_path}")
+# -------- Z-score Statistics --------
+class RunningStats:
+    """Mergeable per-column count/mean/M2 accumulator (Chan et al. parallel variance)."""
 
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.rows = 0
+        self.count = np.zeros(len(self.columns))
+        self.mean = np.zeros(len(self.columns))
+        self.m2 = np.zeros(len(self.columns))
 
-# -------- Save to MongoDB --------
-load_dotenv()
-MONGO_URI = os.getenv("MONGODB_URI")
-MONGO_USER = os.getenv("MONGO_USER")
-MONGO_PASS = os.getenv("MONGO_PASS")
+    def update(self, frame):
+        values = frame[self.columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+        batch = RunningStats(self.columns)
+        batch.rows = len(values)
+        batch.count = np.sum(~np.isnan(values), axis=0).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            batch.mean = np.where(batch.count > 0, np.nansum(values, axis=0) / batch.count, 0.0)
+        batch.m2 = np.nansum((values - batch.mean) ** 2, axis=0)
+        self.merge(batch)
 
-print("MONGO_URI:", MONGO_URI)
-print("MONGO_USER:", MONGO_USER)
-# Do not print MONGO_PASS in production logs; this is helpful for local debugging only
+    def merge(self, other):
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean = np.where(n > 0, self.mean + delta * other.count / n, 0.0)
+            self.m2 = self.m2 + other.m2 + np.where(n > 0, delta ** 2 * self.count * other.count / n, 0.0)
+        self.count = n
+        self.rows += other.rows
 
-# Attempt to connect to a real MongoDB instance first. If credentials are missing
-# or the connection fails, fall back to an in-memory mongomock instance so the
-# script can run without a running MongoDB server (useful for development/tests).
-if not all([MONGO_URI, MONGO_USER, MONGO_PASS]):
-    print("MongoDB credentials are missing. Please set MONGODB_URI, MONGO_USER, and MONGO_PASS in your .env file.")
-    raise SystemExit(1)
+    def means(self):
+        return pd.Series(np.where(self.count > 0, self.mean, np.nan), index=self.columns)
 
-url = f"mongodb+srv://{MONGO_USER}:{MONGO_PASS}@{MONGO_URI}/?retryWrites=true&w=majority"
-print("Attempting MongoDB connection to:", url)
-try:
-    client = pymongo.MongoClient(url, serverSelectionTimeoutMS=5000)
-    client.admin.command('ping')
-    print("MongoDB client created")
-except Exception as e:
-    print("MongoDB connection error:", e)
-    print("Ensure MongoDB is accessible and your credentials are correct.")
-    raise SystemExit(1)
-
-# Select database and collection
-db = client["water_quality_data"]
-collection = db["asv_1"]
-
-# Clear the collection before inserting cleaned records (intentional behavior)
-collection.delete_many({})
-
-df_clean = df_clean.rename(columns={
+    def stds(self):
+        # population std (ddof=0); zero -> NaN to avoid divide-by-zero
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(self.m2 / self.count)
+        return pd.Series(std, index=self.columns).replace(0, np.nan)
+
+    def to_doc(self):
+        return {"columns": self.columns, "rows": self.rows, "count": self.count.tolist(),
+                "mean": self.mean.tolist(), "m2": self.m2.tolist()}
+
+    @classmethod
+    def from_doc(cls, doc):
+        stats = cls(doc["columns"])
+        stats.rows = doc["rows"]
+        stats.count = np.array(doc["count"], dtype=float)
+        stats.mean = np.array(doc["mean"], dtype=float)
+        stats.m2 = np.array(doc["m2"], dtype=float)
+        return stats
+
+
+def scan_file(path, chunksize=None):
+    """First pass over one file: returns (RunningStats, lenient)."""
+    for lenient in (False, True):
+        stats = RunningStats(NUMERIC_COLS)
+        try:
+            for chunk in read_chunks(path, STREAM_COLS, chunksize, lenient=lenient):
+                stats.update(chunk)
+        except ValueError:
+            if lenient:
+                raise
+            continue
+        return stats, lenient
+
+
+def scan_files(csv_files, chunksize=None, pool=None):
+    """Run the first pass over every file, optionally across a process pool.
+
+    Each file is reduced to a partial RunningStats in its own process.
+    Returns {path: (partial stats, lenient)}; see merge_stats.
+    """
+    if pool is None:
+        results = (scan_file(path, chunksize) for path in csv_files)
+    else:
+        results = pool.map(scan_file, csv_files, repeat(chunksize))
+    return dict(zip(csv_files, results))
+
+
+def merge_stats(partials):
+    stats = RunningStats(NUMERIC_COLS)
+    for partial in partials:
+        stats.merge(partial)
+    return stats
+
+
+# -------- Rolling Scores --------
+# A global z-score flags whole warm or salty missions and misses short sensor
+# spikes, so every row also gets a robust rolling score per mission (source
+# file + date): (x - median) / (1.4826 * MAD) over a centered window of
+# ROLLING_WINDOW samples. It is stored with the row for the API's
+# method=rolling and drives cleaning under --outlier-mode rolling.
+ROLLING_WINDOW = 61  # samples: 30 either side of the row
+ROLLING_MIN_PERIODS = 10
+ROLLING_THRESH = 3.5  # the usual cut-off for modified z-scores
+ROLLING_BLOCK = 4096  # rows scored per window array (about 6 MB for three columns)
+ROLLING_SCORES = {
+    "Temperature (c)": "rolling_z_temperature",
+    "Salinity (ppt)": "rolling_z_salinity",
+    "ODO mg/L": "rolling_z_odo",
+}
+
+
+def rolling_robust_z(values, window=ROLLING_WINDOW, min_periods=ROLLING_MIN_PERIODS, block=ROLLING_BLOCK):
+    """Centered-window robust z-scores of a 2-D (rows x columns) array.
+
+    Every window is materialized as a strided view, so the median and MAD
+    are exact and vectorized. Rows are scored ``block`` at a time, so the
+    window arrays stay a few MB however long a mission is. A window with
+    MAD 0 (flat, quantized signals) falls back to the mean absolute
+    deviation; NaN where neither spreads.
+    """
+    half = window // 2
+    pad = np.full((half, values.shape[1]), np.nan)
+    padded = np.vstack([pad, values, pad])
+    scores = np.full(values.shape, np.nan)
+    for start in range(0, len(values), block):
+        stop = min(start + block, len(values))
+        windows = np.lib.stride_tricks.sliding_window_view(padded[start:stop + 2 * half], 2 * half + 1, axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN windows
+            median = np.nanmedian(windows, axis=2)
+            deviation = np.abs(windows - median[..., None])
+            scale = 1.4826 * np.nanmedian(deviation, axis=2)
+            scale = np.where(scale > 0, scale, 1.2533 * np.nanmean(deviation, axis=2))
+        enough = np.sum(~np.isnan(windows), axis=2) >= min_periods
+        with np.errstate(divide="ignore", invalid="ignore"):
+            block_scores = (values[start:stop] - median) / scale
+        scores[start:stop] = np.where(enough & (scale > 0), block_scores, np.nan)
+    return scores
+
+
+class RollingScorer:
+    """Adds ROLLING_SCORES columns to consecutive chunks of one file.
+
+    A centered window needs rows on both sides, so the last half window of
+    each chunk is held back until the next chunk arrives (or is scored with
+    it when the chunk is ``final``), and the half window before it is kept
+    as context. Scores therefore do not depend on where the chunk
+    boundaries fall.
+    """
+
+    def __init__(self):
+        self.half = ROLLING_WINDOW // 2
+        self.context = np.empty((0, len(NUMERIC_COLS)))
+        self.context_missions = np.empty(0, dtype=object)
+        self.pending = None
+
+    def score(self, chunk, final=False):
+        """Scored rows whose whole window has been seen (every remaining row when ``final``)."""
+        frame = chunk if self.pending is None else pd.concat([self.pending, chunk])
+        values = frame[NUMERIC_COLS].to_numpy(dtype=float)
+        missions = frame["Date"].to_numpy(dtype=object) if "Date" in frame.columns else np.zeros(len(frame), dtype=object)
+        all_values = np.vstack([self.context, values])
+        all_missions = pd.Series(np.concatenate([self.context_missions, missions]))
+
+        scores = np.full(all_values.shape, np.nan)
+        for rows in all_missions.groupby(all_missions, sort=False).indices.values():
+            scores[rows] = rolling_robust_z(all_values[rows])
+        scores = scores[len(self.context):]
+
+        ready = len(frame) if final else max(len(frame) - self.half, 0)
+        self.context = np.vstack([self.context, values[:ready]])[-self.half:]
+        self.context_missions = np.concatenate([self.context_missions, missions[:ready]])[-self.half:]
+        self.pending = frame.iloc[ready:]
+        return frame.iloc[:ready].assign(
+            **{ROLLING_SCORES[col]: scores[:ready, i] for i, col in enumerate(NUMERIC_COLS)})
+
+
+def clean_chunk(chunk, means, stds, outlier_mode="global"):
+    """Drop rows whose score exceeds the threshold in any NUMERIC_COLS column:
+    the global z-score against THRESH, or in rolling mode the ROLLING_SCORES
+    columns against ROLLING_THRESH.
+
+    Returns (cleaned frame, number of rows flagged as outliers).
+    """
+    if outlier_mode == "rolling":
+        is_outlier = (chunk[list(ROLLING_SCORES.values())].abs() > ROLLING_THRESH).any(axis=1)
+    else:
+        z = (chunk[NUMERIC_COLS] - means) / stds
+        is_outlier = (z.abs() > THRESH).any(axis=1)
+
+    # drop outliers
+    cleaned = chunk.loc[~is_outlier].copy()
+    cleaned = cleaned.dropna(subset=NUMERIC_COLS)
+    return cleaned, int(is_outlier.sum())
+
+
+def clean_files(csv_files, means, stds, columns, chunksize, lenient, outlier_mode="global"):
+    """Second pass: yield (path, cleaned chunk, outliers removed) for every file."""
+    for path in csv_files:
+        scorer = RollingScorer()
+        chunks = read_chunks(path, columns, chunksize, lenient=lenient.get(path, False))
+        chunk = next(chunks, None)
+        while chunk is not None:
+            # read one chunk ahead so the held-back rows go out with the file's last chunk
+            following = next(chunks, None)
+            # ensure numeric (non-numeric -> NaN)
+            chunk[NUMERIC_COLS] = chunk[NUMERIC_COLS].apply(pd.to_numeric, errors="coerce")
+            scored = scorer.score(chunk, final=following is None)
+            if not scored.empty:
+                yield (path, *clean_chunk(scored, means, stds, outlier_mode))
+            chunk = following
+
+
+# cleaned chunks a --workers process may get ahead of the parent, per file
+CLEAN_QUEUE_CHUNKS = 2
+
+
+def clean_file(queue, path, means, stds, columns, chunksize, lenient, outlier_mode="global"):
+    """Clean one file (a shard) in a worker, putting each (cleaned chunk, outliers removed) on ``queue``.
+
+    ``queue`` is bounded, so the worker waits while the parent is behind.
+    None marks the end of the file, also when cleaning failed.
+    """
+    try:
+        for _, cleaned, removed in clean_files([path], means, stds, columns, chunksize, {path: lenient}, outlier_mode):
+            queue.put((cleaned, removed))
+    finally:
+        queue.put(None)
+
+
+def parallel_clean_files(pool, manager, csv_files, means, stds, columns, chunksize, lenient, window,
+                         outlier_mode="global"):
+    """Second pass across a process pool, yielding chunks in file order like clean_files.
+
+    ``window`` files are cleaned at once and each hands its chunks over
+    through a queue of CLEAN_QUEUE_CHUNKS, so at most about
+    window x (CLEAN_QUEUE_CHUNKS + 1) chunks are in memory.
+    """
+    files = iter(csv_files)
+    pending = deque()
+
+    def submit(path):
+        queue = manager.Queue(CLEAN_QUEUE_CHUNKS)
+        future = pool.submit(clean_file, queue, path, means, stds, columns, chunksize, lenient.get(path, False),
+                             outlier_mode)
+        pending.append((path, queue, future))
+
+    for path in islice(files, window):
+        submit(path)
+    while pending:
+        path, queue, future = pending.popleft()
+        for cleaned, removed in iter(queue.get, None):
+            yield path, cleaned, removed
+        future.result()  # re-raises an error from the worker
+        for path in islice(files, 1):
+            submit(path)
+
+
+def iter_cleaned(args, csv_files, means, stds, columns, chunksize, lenient, pool, manager):
+    if pool is None:
+        return clean_files(csv_files, means, stds, columns, chunksize, lenient, args.outlier_mode)
+    return parallel_clean_files(pool, manager, csv_files, means, stds, columns, chunksize, lenient,
+                                window=2 * args.workers, outlier_mode=args.outlier_mode)
+
+
+# -------- Ingest Manifest --------
+# One document per ingested source file, keyed by its normalized path, so that
+# --incremental can tell new or changed files from ones already loaded. Each
+# entry keeps the file's partial RunningStats so the global z-score can be
+# rebuilt without re-reading unchanged files.
+MANIFEST_COLLECTION = "ingest_manifest"
+
+
+def source_key(path):
+    return os.path.normpath(path).replace(os.sep, "/")
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_entry(path, partial, sha256=None):
+    st = os.stat(path)
+    return {
+        "_id": source_key(path),
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "sha256": sha256 or file_sha256(path),
+        "stats": partial.to_doc(),
+        "ingested_at": datetime.now(timezone.utc),
+    }
+
+
+def changed_files(csv_files, manifest_docs):
+    """Split csv_files into (changed, {path: sha256}) against the manifest.
+
+    Size and mtime are checked first; the content hash is only computed when
+    they differ, and a matching hash just refreshes the manifest entry.
+    """
+    changed = []
+    hashes = {}
+    for path in csv_files:
+        entry = manifest_docs.get(source_key(path))
+        st = os.stat(path)
+        if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            continue
+        hashes[path] = file_sha256(path)
+        if entry and entry["sha256"] == hashes[path]:
+            entry.update(size=st.st_size, mtime=st.st_mtime)
+            continue
+        changed.append(path)
+    return changed, hashes
+
+
+# -------- MongoDB --------
+def connect_collection():
+    load_dotenv()
+    MONGO_URI = os.getenv("MONGODB_URI")
+    MONGO_USER = os.getenv("MONGO_USER")
+    MONGO_PASS = os.getenv("MONGO_PASS")
+
+    print("MONGO_URI:", MONGO_URI)
+    print("MONGO_USER:", MONGO_USER)
+    # Do not print MONGO_PASS in production logs; this is helpful for local debugging only
+
+    if not all([MONGO_URI, MONGO_USER, MONGO_PASS]):
+        print("MongoDB credentials are missing. Please set MONGODB_URI, MONGO_USER, and MONGO_PASS in your .env file.")
+        raise SystemExit(1)
+
+    url = f"mongodb+srv://{MONGO_USER}:{MONGO_PASS}@{MONGO_URI}/?retryWrites=true&w=majority"
+    print("Attempting MongoDB connection to:", url)
+    try:
+        client = pymongo.MongoClient(url, serverSelectionTimeoutMS=5000)
+        client.admin.command('ping')
+        print("MongoDB client created")
+    except Exception as e:
+        print("MongoDB connection error:", e)
+        print("Ensure MongoDB is accessible and your credentials are correct.")
+        raise SystemExit(1)
+
+    # Select database and collection
+    db = client["water_quality_data"]
+    return db["asv_1"]
+
+
+# source column -> stored field name
+COLUMN_RENAMES = {
     "Temperature (c)": "temperature",
     "Salinity (ppt)": "salinity",
     "ODO mg/L": "odo",
     "Date": "date",
     "Latitude": "latitude",
     "Longitude": "longitude"
-})
+}
+
+
+def geojson_point(lat, lon):
+    """GeoJSON Point for the 2dsphere index, or None for missing/invalid fixes."""
+    if lat is None or lon is None:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def add_timestamp(df):
+    """Add a typed ``timestamp`` from the MM/DD/YY date and "Time hh:mm:ss" strings.
+
+    Stored as a BSON datetime it gives the API indexed time-range queries;
+    rows whose date or time does not parse get none.
+    """
+    if "date" not in df.columns or "Time hh:mm:ss" not in df.columns:
+        return df
+    stamp = df["date"].astype(str) + " " + df["Time hh:mm:ss"].astype(str)
+    return df.assign(timestamp=pd.to_datetime(stamp, format="%m/%d/%y %H:%M:%S", errors="coerce"))
+
+
+def iter_record_batches(df_clean, source_file, batch_size):
+    """Yield BSON-ready record lists, ``batch_size`` rows at a time.
+
+    Only one batch of Python dicts exists at any point; NaN becomes None and
+    every document is tagged with its source file so one file can be replaced
+    on its own.
+    """
+    df_clean = add_timestamp(df_clean.rename(columns=COLUMN_RENAMES))
+    for start in range(0, len(df_clean), batch_size):
+        part = df_clean.iloc[start:start + batch_size]
+        part = part.astype(object).where(part.notna(), None)
+        records = part.to_dict("records")
+        for record in records:
+            record["source_file"] = source_file
+            location = geojson_point(record.get("latitude"), record.get("longitude"))
+            if location is not None:
+                record["location"] = location
+        yield records
+
+
+class BulkLoader:
+    """Unordered insert_many batches written from a pool of writer threads.
+
+    At most two batches per writer are in flight; each finished batch is
+    reported with its throughput, and a BulkWriteError only fails the
+    documents it names instead of aborting the load.
+    """
+
+    def __init__(self, collection, batch_size=5000, writers=4):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=writers, thread_name_prefix="mongo-writer")
+        self.max_pending = 2 * writers
+        self.pending = deque()
+        self.batches = 0
+        self.inserted = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+
+    def add(self, df_clean, source_file):
+        for records in iter_record_batches(df_clean, source_file, self.batch_size):
+            if len(self.pending) >= self.max_pending:
+                self._finish(self.pending.popleft())
+            self.pending.append(self.pool.submit(self._write, records))
+
+    def _write(self, records):
+        started = time.perf_counter()
+        try:
+            result = self.collection.insert_many(records, ordered=False)
+            inserted, errors = len(result.inserted_ids), []
+        except BulkWriteError as e:
+            inserted, errors = e.details.get("nInserted", 0), e.details.get("writeErrors", [])
+        return len(records), inserted, errors, time.perf_counter() - started
+
+    def _finish(self, future):
+        size, inserted, errors, seconds = future.result()
+        self.batches += 1
+        self.inserted += inserted
+        self.failed += size - inserted
+        rate = inserted / seconds if seconds > 0 else float("inf")
+        print(f"Batch {self.batches}: {inserted}/{size} docs in {seconds:.3f}s ({rate:,.0f} docs/s)")
+        if errors:
+            print(f"  {len(errors)} write errors, first: {errors[0].get('errmsg')}")
+
+    def flush(self):
+        while self.pending:
+            self._finish(self.pending.popleft())
+
+    def close(self):
+        self.flush()
+        self.pool.shutdown()
+        seconds = time.perf_counter() - self.started
+        rate = self.inserted / seconds if seconds > 0 else float("inf")
+        print(f"Inserted {self.inserted} documents in {self.batches} batches "
+              f"({self.failed} failed) in {seconds:.2f}s ({rate:,.0f} docs/s)")
+
+
+# -------- Field Summaries --------
+# Per (source file, date, field) statistics written next to the data so the
+# API can answer stats and outlier-threshold questions without scanning
+# asv_1. Every part is mergeable: count/mean/M2 combine like RunningStats and
+# the t-digest centroids of any set of dates can simply be pooled.
+SUMMARY_COLLECTION = "field_stats"
+SUMMARY_FIELDS = ["temperature", "salinity", "odo", "pH", "latitude", "longitude"]
+SUMMARY_INDEXES = [
+    pymongo.IndexModel([("field", pymongo.ASCENDING), ("day", pymongo.ASCENDING)], name="field_day"),
+    pymongo.IndexModel([("source_file", pymongo.ASCENDING)], name="source_file"),
+]
+
+
+# Groups up to this many values keep every value as a weight-1 centroid, so
+# their quantiles are exact: a digest interpolates across gaps between
+# clusters, which is far off for a few hundred bimodal readings.
+TDIGEST_EXACT = 2000
+
+
+class TDigest:
+    """Merging t-digest quantile sketch (Dunning), compressed with the k1 scale function.
+
+    Points are grouped by the integer part of k(q) = delta/(2*pi) * asin(2q - 1),
+    which keeps at most delta/2 + 1 centroids with small ones at both tails.
+    Nothing is compressed while there are at most ``exact`` centroids.
+    """
+
+    def __init__(self, delta=200, exact=TDIGEST_EXACT):
+        self.delta = delta
+        self.exact = exact
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        self._compress(values, np.ones(len(values)))
+
+    def merge(self, other):
+        self._compress(other.means, other.weights)
+
+    def _compress(self, means, weights):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        if means.size == 0:
+            return
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        if means.size <= self.exact:
+            self.means, self.weights = means, weights
+            return
+        q = (np.cumsum(weights) - weights / 2) / weights.sum()
+        k = np.floor(self.delta / (2 * np.pi) * np.arcsin(2 * q - 1) + self.delta / 4)
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def centroids(self):
+        return [[float(m), float(w)] for m, w in zip(self.means, self.weights)]
+
+
+class DaySummary:
+    """count/mean/M2/min/max and a t-digest per field for one (source file, date)."""
+
+    def __init__(self, fields):
+        self.stats = RunningStats(fields)
+        self.min = np.full(len(fields), np.inf)
+        self.max = np.full(len(fields), -np.inf)
+        self.digests = [TDigest() for _ in fields]
+
+    def update(self, frame):
+        values = frame[self.stats.columns].apply(pd.to_numeric, errors="coerce")
+        self.stats.update(values)
+        values = values.to_numpy(dtype=float)
+        self.min = np.fmin(self.min, np.fmin.reduce(values, axis=0, initial=np.inf))
+        self.max = np.fmax(self.max, np.fmax.reduce(values, axis=0, initial=-np.inf))
+        for i, digest in enumerate(self.digests):
+            column = values[:, i]
+            digest.update(column[np.isfinite(column)])
+
+    def docs(self, source_file, date, day):
+        for i, field in enumerate(self.stats.columns):
+            if self.stats.count[i] == 0:
+                continue
+            yield {
+                "source_file": source_file,
+                "date": date,
+                "day": day,
+                "field": field,
+                "rows": self.stats.rows,
+                "count": int(self.stats.count[i]),
+                "mean": float(self.stats.mean[i]),
+                "m2": float(self.stats.m2[i]),
+                "min": float(self.min[i]),
+                "max": float(self.max[i]),
+                "centroids": self.digests[i].centroids(),
+            }
+
+
+class FieldSummaries:
+    """Accumulates a DaySummary for every (source file, date) seen in the cleaned data."""
+
+    def __init__(self):
+        self.days = {}
+
+    def add(self, df_clean, source_file):
+        df = df_clean.rename(columns=COLUMN_RENAMES)
+        fields = [f for f in SUMMARY_FIELDS if f in df.columns]
+        if not fields or "date" not in df.columns or df.empty:
+            return
+        for date, part in df.groupby("date", sort=False):
+            key = (source_file, date)
+            if key not in self.days:
+                self.days[key] = DaySummary(fields)
+            self.days[key].update(part)
+
+    def pop_docs(self, source_file=None):
+        """Docs for one source file (or all of them), dropping them from memory."""
+        keys = [key for key in self.days if source_file is None or key[0] == source_file]
+        docs = []
+        for key in keys:
+            day = pd.to_datetime(key[1], format="%m/%d/%y", errors="coerce")
+            day = None if pd.isna(day) else day.strftime("%Y-%m-%d")
+            docs.extend(self.days.pop(key).docs(key[0], key[1], day))
+        return docs
+
+
+# -------- Geo Tiles --------
+# Per (source file, date, zoom, tile) aggregates so the map can be drawn from
+# a bounded number of cells at any zoom. Tiles are the usual slippy-map
+# (web mercator) x/y at each zoom in TILE_ZOOMS; sums and counts merge across
+# files and dates by simple addition.
+TILE_COLLECTION = "geo_tiles"
+TILE_ZOOMS = range(4, 23)
+TILE_FIELDS = ["temperature", "salinity", "odo"]
+TILE_INDEXES = [
+    pymongo.IndexModel([("zoom", pymongo.ASCENDING), ("day", pymongo.ASCENDING),
+                        ("x", pymongo.ASCENDING), ("y", pymongo.ASCENDING)], name="zoom_day_xy"),
+    pymongo.IndexModel([("source_file", pymongo.ASCENDING)], name="source_file"),
+]
+MAX_MERCATOR_LAT = 85.0511287798
+
+
+def tile_coords(lat, lon, zoom):
+    """Slippy-map tile x/y arrays for latitude/longitude arrays at ``zoom``."""
+    n = 2 ** zoom
+    x = np.floor((lon + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+class GeoTiles:
+    """Accumulates per-tile counts, sums and extents for every zoom in TILE_ZOOMS.
+
+    Rows are only binned at the finest zoom. A tile at zoom z - 1 covers the
+    tiles (x, y) of zoom z with the same (x >> 1, y >> 1), so pop_docs builds
+    each coarser zoom by merging the one below it. Tiles are held as NumPy
+    arrays (date code, x, y, sums, minima, maxima) and merged with a sort and
+    reduceat, which stays cheap for the few thousand tiles of a file.
+    """
+
+    SUM_COLUMNS = ["count", "lat_sum", "lon_sum"] + [f"{f}_{s}" for f in TILE_FIELDS for s in ("sum", "count")]
+    COUNT_COLUMNS = {c for c in SUM_COLUMNS if c == "count" or c.endswith("_count")}
+    COMPACT_EVERY = 32  # partial tile sets held per file before they are merged
+
+    def __init__(self):
+        self.parts = {}  # source file -> list of tile sets
+        self.dates = {}  # source file -> {date: code}
+
+    def add(self, df_clean, source_file):
+        df = df_clean.rename(columns=COLUMN_RENAMES)
+        if not {"latitude", "longitude", "date"} <= set(df.columns) or df.empty:
+            return
+        lat = pd.to_numeric(df["latitude"], errors="coerce")
+        lon = pd.to_numeric(df["longitude"], errors="coerce")
+        ok = lat.between(-MAX_MERCATOR_LAT, MAX_MERCATOR_LAT) & lon.between(-180, 180) & df["date"].notna()
+        if not ok.any():
+            return
+        df, lat, lon = df[ok], lat[ok].to_numpy(), lon[ok].to_numpy()
+
+        codes, labels = pd.factorize(df["date"])
+        dates = self.dates.setdefault(source_file, {})
+        codes = np.array([dates.setdefault(label, len(dates)) for label in labels], dtype=np.int64)[codes]
+        sums = [np.ones(len(df)), lat, lon]
+        for f in TILE_FIELDS:
+            values = pd.to_numeric(df[f], errors="coerce").to_numpy() if f in df.columns else np.full(len(df), np.nan)
+            present = np.isfinite(values)
+            sums += [np.where(present, values, 0.0), present.astype(float)]
+        x, y = tile_coords(lat, lon, TILE_ZOOMS[-1])
+
+        parts = self.parts.setdefault(source_file, [])
+        parts.append(self._merge(codes, x, y, np.column_stack(sums),
+                                 np.column_stack([lat, lon]), np.column_stack([lat, lon])))
+        if len(parts) >= self.COMPACT_EVERY:
+            self.parts[source_file] = [self._merge(*self._concat(parts))]
+
+    @staticmethod
+    def _concat(parts):
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    @staticmethod
+    def _merge(codes, x, y, sums, mins, maxs):
+        """One tile per distinct (date code, x, y): sums added, lat/lon minima and maxima kept."""
+        order = np.lexsort((y, x, codes))
+        codes, x, y = codes[order], x[order], y[order]
+        starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (x[1:] != x[:-1]) | (y[1:] != y[:-1])])
+        return (codes[starts], x[starts], y[starts], np.add.reduceat(sums[order], starts),
+                np.minimum.reduceat(mins[order], starts), np.maximum.reduceat(maxs[order], starts))
+
+    def pop_docs(self, source_file=None):
+        """Docs for one source file (or all of them), dropping them from memory.
+
+        A generator: only one zoom level's docs are built at a time.
+        """
+        keys = [key for key in self.parts if source_file is None or key == source_file]
+        for key in keys:
+            tiles = self._merge(*self._concat(self.parts.pop(key)))
+            labels = pd.Series(list(self.dates.pop(key)), dtype=object)
+            days = pd.to_datetime(labels, format="%m/%d/%y", errors="coerce").dt.strftime("%Y-%m-%d")
+            days = days.astype(object).where(days.notna(), None).to_numpy()
+            for zoom in reversed(TILE_ZOOMS):
+                if zoom != TILE_ZOOMS[-1]:
+                    codes, x, y, sums, mins, maxs = tiles
+                    tiles = self._merge(codes, x >> 1, y >> 1, sums, mins, maxs)
+                yield from self._docs(key, labels.to_numpy(), days, zoom, *tiles)
+
+    def _docs(self, source_file, labels, days, zoom, codes, x, y, sums, mins, maxs):
+        n = len(codes)
+        columns = {"source_file": [source_file] * n, "date": labels[codes].tolist(), "day": days[codes].tolist(),
+                   "zoom": [zoom] * n, "x": x.tolist(), "y": y.tolist()}
+        for i, name in enumerate(self.SUM_COLUMNS):
+            column = sums[:, i]
+            columns[name] = (column.astype(np.int64) if name in self.COUNT_COLUMNS else column).tolist()
+        columns["lat_min"], columns["lat_max"] = mins[:, 0].tolist(), maxs[:, 0].tolist()
+        columns["lon_min"], columns["lon_max"] = mins[:, 1].tolist(), maxs[:, 1].tolist()
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+# Collections derived from the cleaned rows, rebuilt alongside asv_1:
+# (collection name, its indexes, accumulator class)
+DERIVED_OUTPUTS = [
+    (SUMMARY_COLLECTION, SUMMARY_INDEXES, FieldSummaries),
+    (TILE_COLLECTION, TILE_INDEXES, GeoTiles),
+]
+
+
+def insert_batches(target, docs, batch_size):
+    """insert_many ``docs`` (any iterable) ``batch_size`` documents at a time."""
+    docs = iter(docs)
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            return
+        target.insert_many(batch, ordered=False)
+
+
+def write_derived(target, indexes, docs, source_file=None, batch_size=5000):
+    """Replace the docs of ``source_file`` (or every doc) in a derived collection."""
+    target.create_indexes(indexes)
+    target.delete_many({} if source_file is None else {"source_file": source_file})
+    insert_batches(target, docs, batch_size)
+
+
+# -------- Parquet Dataset --------
+# The cleaned rows again, as a hive-partitioned Parquet dataset under
+# PARQUET_DIR: one ``day=YYYY-MM-DD`` directory per mission date holding one
+# file per source CSV, with the stored field names, typed columns (floats,
+# strings, a timestamp) and per-row-group min/max statistics. Readers can
+# prune by day and by column instead of re-parsing cleaned.csv.
+PARQUET_ROW_GROUP = 100_000
+PARQUET_NULL_DAY = "__HIVE_DEFAULT_PARTITION__"  # pyarrow's name for a missing partition value
+PARQUET_SCHEMA_FILE = "_common_metadata"
+
+
+def parquet_schema(df):
+    """Arrow schema for the dataset, fixed by the first chunk written.
+
+    Integer columns are widened to float64 so a later chunk with gaps still
+    fits, and columns that are empty in the first chunk are stored as text.
+    """
+    fields = []
+    for field in pa.Schema.from_pandas(df, preserve_index=False):
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.float64())
+        elif pa.types.is_null(field.type) or pa.types.is_boolean(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def conform_frame(df, schema):
+    """Coerce ``df`` column by column to ``schema``; source files need not agree on dtypes."""
+    df = df.reindex(columns=schema.names)
+    for field in schema:
+        column = df[field.name]
+        if pa.types.is_floating(field.type):
+            df[field.name] = pd.to_numeric(column, errors="coerce")
+        elif pa.types.is_timestamp(field.type):
+            df[field.name] = pd.to_datetime(column, errors="coerce")
+        elif column.dtype != object:
+            df[field.name] = column.astype(str).where(column.notna(), None)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+class ParquetDataset:
+    """Writes cleaned chunks into the day-partitioned Parquet dataset at ``root``.
+
+    Chunks of one source file are buffered per day and written in row groups
+    of PARQUET_ROW_GROUP rows. Each file is written under a dot-prefixed name,
+    which dataset readers skip, and renamed into place when the source file
+    ends. A source file's parts can be removed on their own, as for asv_1.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.schema = None
+        schema_path = os.path.join(root, PARQUET_SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            # keep appended parts compatible with the files already there
+            self.schema = pq.read_schema(schema_path)
+        self.source_file = None
+        self.writers = {}
+        self.pending = {}
+
+    @staticmethod
+    def part_name(source_file):
+        return re.sub(r"[^\w.-]", "_", source_file) + ".parquet"
+
+    def add(self, df_clean, source_file):
+        if source_file != self.source_file:
+            self.close_source()
+            self.source_file = source_file
+        df = add_timestamp(df_clean.rename(columns=COLUMN_RENAMES)).assign(source_file=source_file)
+        if self.schema is None:
+            self.schema = parquet_schema(df)
+        days = pd.to_datetime(df["date"], format="%m/%d/%y", errors="coerce") if "date" in df.columns \
+            else pd.Series(pd.NaT, index=df.index)
+        days = days.dt.strftime("%Y-%m-%d").fillna(PARQUET_NULL_DAY)
+        for day, part in df.groupby(days, sort=False):
+            self.pending.setdefault(day, []).append(conform_frame(part, self.schema))
+            if sum(t.num_rows for t in self.pending[day]) >= PARQUET_ROW_GROUP:
+                self._write(day)
+
+    def _write(self, day):
+        table = pa.concat_tables(self.pending.pop(day))
+        if day not in self.writers:
+            directory = os.path.join(self.root, f"day={day}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "." + self.part_name(self.source_file))
+            self.writers[day] = (pq.ParquetWriter(path, self.schema, compression="zstd"), path)
+        self.writers[day][0].write_table(table, row_group_size=PARQUET_ROW_GROUP)
+
+    def close_source(self):
+        """Flush and publish every file of the current source file."""
+        for day in list(self.pending):
+            self._write(day)
+        for writer, path in self.writers.values():
+            writer.close()
+            directory, name = os.path.split(path)
+            os.replace(path, os.path.join(directory, name[1:]))
+        self.writers = {}
+
+    def remove_source(self, source_file):
+        name = self.part_name(source_file)
+        for path in glob.glob(os.path.join(self.root, "day=*", name)):
+            os.remove(path)
+            if not os.listdir(os.path.dirname(path)):
+                os.rmdir(os.path.dirname(path))
+
+    def close(self):
+        self.close_source()
+        if self.schema is not None:
+            os.makedirs(self.root, exist_ok=True)
+            pq.write_metadata(self.schema, os.path.join(self.root, PARQUET_SCHEMA_FILE))
+
+
+def replace_dir(staging, live):
+    """Move ``staging`` over ``live``; the old copy is only deleted once the new one is in place."""
+    old = live + STAGING_SUFFIX + "_old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(live):
+        os.rename(live, old)
+    os.rename(staging, live)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+# -------- Local Column Store --------
+# The cleaned rows in the layout api/local_engine.py memory-maps when the API
+# runs with API_BACKEND=local. There is one .npy file per column, and rows are
+# sorted by (timestamp, load order), so a row's number is its page position
+# and serves as its ``_id``. Each LOCAL_ORDERED_FIELDS column also gets an
+# argsort (NaN last). Numbers are float64 with NaN for missing, plus a per-row
+# flag file for the values that were integers, so they come back as ints like
+# they do from MongoDB. Timestamps are datetime64[ms] with NaT, and strings
+# int32 codes into the column's ``categories`` (-1 for missing). meta.json,
+# written last, lists the columns and the distinct dates, and carries the
+# dataset generation the API watches.
+#
+# Every build goes into its own v<time> directory and CURRENT names the live
+# one. The API keeps the files of the version it mapped open, so a directory
+# is never renamed; a build only removes versions older than the one it
+# replaces (Windows refuses while a file is mapped, so those are retried by
+# the next build).
+LOCAL_STORE_DIR = os.path.join(OUTPUT_DIR, "columns")
+LOCAL_ORDERED_FIELDS = SUMMARY_FIELDS + list(ROLLING_SCORES.values())
+LOCAL_KINDS = {"float": "float64", "time": "datetime64[ms]", "str": "int32"}
+LOCAL_META_FILE = "meta.json"
+LOCAL_CURRENT_FILE = "CURRENT"
+LOCAL_COPY_ROWS = 100_000
+
+
+class LocalStore:
+    """Builds a new version of the local column store under ``base`` one chunk at a time.
+
+    Chunks are appended to one raw file per column. ``close`` then sorts the
+    columns into place one at a time and publishes the version. That sort
+    holds the row order plus one whole column and its argsort, about 32 bytes
+    per row, so unlike the rest of a --stream run its memory grows with the
+    dataset; the store is only built with --local-store, or once one exists.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.version = f"v{time.time_ns()}"
+        self.root = os.path.join(base, self.version)
+        self.parts = os.path.join(self.root, "parts")
+        self.rows = 0
+        self.columns = {}  # name -> {"kind": ..., "categories": {value: code}}
+        os.makedirs(self.parts)
+
+    def add(self, df_clean, source_file):
+        df = add_timestamp(df_clean.rename(columns=COLUMN_RENAMES))
+        self.append(df.assign(source_file=source_file))
+
+    def append(self, df, ints=None):
+        """Append a chunk; ``ints`` maps columns to per-row integer flags (default: from their dtype)."""
+        for name in df.columns:
+            if name not in self.columns:
+                self._add_column(name, df[name])
+        for i, (name, column) in enumerate(self.columns.items()):
+            values = df[name] if name in df.columns else pd.Series(None, index=df.index, dtype=object)
+            with open(os.path.join(self.parts, f"c{i}"), "ab") as f:
+                self._encode(column, values).tofile(f)
+            if column["kind"] == "float":
+                if ints is not None and name in ints:
+                    flags = np.asarray(ints[name], dtype=bool)
+                else:
+                    flags = (values.notna() & pd.api.types.is_integer_dtype(values)).to_numpy(dtype=bool)
+                with open(os.path.join(self.parts, f"i{i}"), "ab") as f:
+                    flags.tofile(f)
+        self.rows += len(df)
+
+    def _add_column(self, name, sample):
+        if pd.api.types.is_datetime64_any_dtype(sample):
+            kind = "time"
+        elif pd.api.types.is_numeric_dtype(sample) and not pd.api.types.is_bool_dtype(sample):
+            kind = "float"
+        else:
+            kind = "str"
+        self.columns[name] = column = {"kind": kind, "categories": {}}
+        if self.rows:
+            # earlier chunks did not have this column
+            i = len(self.columns) - 1
+            missing = pd.Series(None, index=range(self.rows), dtype=object)
+            with open(os.path.join(self.parts, f"c{i}"), "ab") as f:
+                self._encode(column, missing).tofile(f)
+            if kind == "float":
+                with open(os.path.join(self.parts, f"i{i}"), "ab") as f:
+                    np.zeros(self.rows, dtype=bool).tofile(f)
+
+    @staticmethod
+    def _encode(column, values):
+        if column["kind"] == "float":
+            return pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        if column["kind"] == "time":
+            return pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[ms]")
+        present = values.notna().to_numpy()
+        text = values[present].astype(str)
+        categories = column["categories"]
+        for value in text.unique():
+            categories.setdefault(value, len(categories))
+        codes = np.full(len(values), -1, dtype=np.int32)
+        codes[present] = text.map(categories).to_numpy(dtype=np.int32)
+        return codes
+
+    def keep(self, live_base, drop_sources):
+        """Copy the rows of every source file not in ``drop_sources`` from the live store under ``live_base``."""
+        live_root = local_store_dir(live_base)
+        meta, arrays = read_local_store(live_base)
+        if meta is None:
+            return
+        source = arrays.get("source_file")
+        categories = {c["name"]: np.array(c.get("categories", []) + [None], dtype=object) for c in meta["columns"]}
+        ints = {c["name"]: np.load(os.path.join(live_root, c["ints"]), mmap_mode="r")
+                for c in meta["columns"] if "ints" in c}
+        if source is None:
+            return
+        dropped = [i for i, name in enumerate(categories["source_file"][:-1]) if name in drop_sources]
+        rows = np.flatnonzero(~np.isin(source, dropped))
+        for start in range(0, len(rows), LOCAL_COPY_ROWS):
+            part = rows[start:start + LOCAL_COPY_ROWS]
+            frame = {}
+            for column in meta["columns"]:
+                values = arrays[column["name"]][part]
+                if column["kind"] == "str":
+                    values = categories[column["name"]][values]  # code -1 picks the trailing None
+                frame[column["name"]] = values
+            self.append(pd.DataFrame(frame), ints={name: flags[part] for name, flags in ints.items()})
+
+    def close(self, generation):
+        names = list(self.columns)
+        part = {name: os.path.join(self.parts, f"c{i}") for i, name in enumerate(names)}
+        if "timestamp" in self.columns:
+            # NaT is the smallest int64, so undated rows come first, as in MongoDB's sort
+            order = np.argsort(np.fromfile(part["timestamp"], dtype=np.int64), kind="stable")
+        else:
+            order = np.arange(self.rows)
+        entries = []
+        for i, name in enumerate(names):
+            column = self.columns[name]
+            values = np.fromfile(part[name], dtype=LOCAL_KINDS[column["kind"]])[order]
+            entry = {"name": name, "kind": column["kind"], "file": f"c{i}.npy"}
+            np.save(os.path.join(self.root, entry["file"]), values)
+            if column["kind"] == "str":
+                entry["categories"] = list(column["categories"])
+            if column["kind"] == "float":
+                flags_part = os.path.join(self.parts, f"i{i}")
+                flags = np.fromfile(flags_part, dtype=bool)[order]
+                if flags.any():
+                    entry["ints"] = f"i{i}.npy"
+                    np.save(os.path.join(self.root, entry["ints"]), flags)
+                os.remove(flags_part)
+            if column["kind"] == "float" and name in LOCAL_ORDERED_FIELDS:
+                entry["order"] = f"o{i}.npy"
+                entry["count"] = int(np.count_nonzero(~np.isnan(values)))
+                np.save(os.path.join(self.root, entry["order"]), np.argsort(values, kind="stable"))
+            entries.append(entry)
+            os.remove(part[name])
+            del values
+        os.rmdir(self.parts)
+
+        dates = []
+        if "date" in self.columns and self.columns["date"]["kind"] == "str":
+            codes = np.load(os.path.join(self.root, f"c{names.index('date')}.npy"))
+            categories = list(self.columns["date"]["categories"])
+            dates = [categories[c] for c in np.unique(codes[codes >= 0])]
+        meta = {"generation": generation, "rows": self.rows, "columns": entries, "dates": dates}
+        with open(os.path.join(self.root, LOCAL_META_FILE), "w") as f:
+            json.dump(meta, f)
+        publish_local_store(self.base, self.version)
+
+
+def local_store_dir(base):
+    """Directory of the live version under ``base`` (``base`` itself for a store built before versions), or None."""
+    try:
+        with open(os.path.join(base, LOCAL_CURRENT_FILE)) as f:
+            return os.path.join(base, f.read().strip())
+    except FileNotFoundError:
+        return base if os.path.exists(os.path.join(base, LOCAL_META_FILE)) else None
+
+
+def publish_local_store(base, version):
+    """Point CURRENT at ``version``, then remove what neither it nor the version it replaces uses."""
+    previous = local_store_dir(base)
+    pointer = os.path.join(base, LOCAL_CURRENT_FILE)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version)
+    for attempt in range(5):
+        try:
+            os.replace(pointer + ".tmp", pointer)
+            break
+        except PermissionError:  # Windows, while the API is reading CURRENT
+            if attempt == 4:
+                raise
+            time.sleep(0.1)
+    keep = {version, LOCAL_CURRENT_FILE}
+    if previous is not None and previous != base:
+        keep.add(os.path.basename(previous))
+    for name in os.listdir(base):
+        if name in keep:
+            continue
+        path = os.path.join(base, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def read_local_store(base):
+    """(meta, {column name: memory-mapped array}) for the live store under ``base``, or (None, {})."""
+    root = local_store_dir(base)
+    if root is None or not os.path.exists(os.path.join(root, LOCAL_META_FILE)):
+        return None, {}
+    with open(os.path.join(root, LOCAL_META_FILE)) as f:
+        meta = json.load(f)
+    arrays = {c["name"]: np.load(os.path.join(root, c["file"]), mmap_mode="r") for c in meta["columns"]}
+    return meta, arrays
+
+
+# -------- Dataset Generation --------
+# The API caches responses per dataset generation; every load that changes
+# the data bumps it so those caches drop their old entries.
+META_COLLECTION = "dataset_meta"
+
+
+def bump_generation(collection):
+    meta = collection.database[META_COLLECTION]
+    doc = meta.find_one_and_update(
+        {"_id": collection.name},
+        {"$inc": {"generation": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER,
+    )
+    print(f"Dataset generation is now {doc['generation']}")
+    return doc["generation"]
+
+
+# -------- Index Specification --------
+# Ingest owns the indexes the API relies on: timestamp plus each measurement
+# for the filtered time-range queries, date for the distinct date list, each
+# measurement and rolling score on its own for the outlier range scans, a
+# 2dsphere index on the GeoJSON ``location`` and the observation page order.
+INDEX_SPEC = [
+    pymongo.IndexModel([("timestamp", pymongo.ASCENDING), ("temperature", pymongo.ASCENDING)],
+                       name="timestamp_temperature"),
+    pymongo.IndexModel([("timestamp", pymongo.ASCENDING), ("salinity", pymongo.ASCENDING)], name="timestamp_salinity"),
+    pymongo.IndexModel([("timestamp", pymongo.ASCENDING), ("odo", pymongo.ASCENDING)], name="timestamp_odo"),
+    pymongo.IndexModel([("date", pymongo.ASCENDING)], name="date"),
+    pymongo.IndexModel([("temperature", pymongo.ASCENDING)], name="temperature"),
+    pymongo.IndexModel([("salinity", pymongo.ASCENDING)], name="salinity"),
+    pymongo.IndexModel([("odo", pymongo.ASCENDING)], name="odo"),
+    pymongo.IndexModel([("location", pymongo.GEOSPHERE)], name="location_2dsphere"),
+    # method=rolling outlier range scans
+    *[pymongo.IndexModel([(score, pymongo.ASCENDING)], name=score) for score in ROLLING_SCORES.values()],
+    # time-range scans and the keyset pagination order of /api/observations
+    pymongo.IndexModel([("timestamp", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], name="timestamp_id"),
+    pymongo.IndexModel([("source_file", pymongo.ASCENDING)], name="source_file"),
+]
+
+
+# Indexes earlier releases created that no query uses any more. Every index
+# sync drops them, --swap does not carry them over, and --check-indexes
+# fails while they exist.
+RETIRED_INDEXES = ["date_temperature", "date_salinity", "date_odo", "date_time_id"]
+
+
+def ensure_indexes(collection):
+    started = time.perf_counter()
+    collection.create_indexes(INDEX_SPEC)
+    retired = [name for name in collection.index_information() if name in RETIRED_INDEXES]
+    for name in retired:
+        collection.drop_index(name)
+    print(f"Ensured {len(INDEX_SPEC)} indexes on {collection.name} in {time.perf_counter() - started:.2f}s")
+    if retired:
+        print(f"Dropped retired indexes: {retired}")
+
+
+def check_indexes(collection):
+    """Print the state of every index on the collection; returns (missing names, retired names).
+
+    Indexes outside INDEX_SPEC are listed as EXTRA (or RETIRED when in
+    RETIRED_INDEXES) so hand-made and leftover indexes are visible.
+    """
+    existing = {name: list(info["key"]) for name, info in collection.index_information().items()}
+    missing = []
+    for model in INDEX_SPEC:
+        name = model.document["name"]
+        keys = list(model.document["key"].items())
+        if existing.get(name) == keys:
+            print(f"  OK       {name} {keys}")
+        else:
+            print(f"  MISSING  {name} {keys}")
+            missing.append(name)
+    specified = {model.document["name"] for model in INDEX_SPEC} | {"_id_"}
+    retired = []
+    for name, keys in existing.items():
+        if name in RETIRED_INDEXES:
+            print(f"  RETIRED  {name} {keys}")
+            retired.append(name)
+        elif name not in specified:
+            print(f"  EXTRA    {name} {keys}")
+    return missing, retired
+
+
+# -------- Staging Collection Swap --------
+STAGING_SUFFIX = "_staging"
+
+
+def copy_indexes(source, target):
+    """Recreate the secondary indexes of ``source`` that ``target`` lacks, except RETIRED_INDEXES."""
+    present = target.index_information()
+    for name, info in source.index_information().items():
+        if name in present or name in RETIRED_INDEXES:
+            continue
+        keys = info.pop("key")
+        for meta in ("v", "ns"):
+            info.pop(meta, None)
+        target.create_index(keys, name=name, **info)
+
+
+def swap_collection(staging, live):
+    """Index the fully loaded staging collection, then rename it over ``live``.
+
+    renameCollection with dropTarget replaces the live collection in one
+    step, so readers only ever see the old dataset or the complete new one.
+    """
+    ensure_indexes(staging)
+    # keep any extra indexes created on the live collection by hand
+    copy_indexes(live, staging)
+    staging.rename(live.name, dropTarget=True)
+    print(f"Swapped {staging.name} -> {live.name}")
+
+
+def print_report(total_rows, removed_rows):
+    remaining_rows = total_rows - removed_rows
+
+    print("=== Cleaning Report ===")
+    print(f"Total rows originally:          {total_rows}")
+    print(f"Rows removed as outliers:       {removed_rows}")
+    print(f"Rows remaining after cleaning:  {remaining_rows}")
+
+
+def main():
+    args = parse_args()
+
+    # In the default mode each file is read whole with every column, which
+    # keeps the stored documents identical to earlier releases. --stream bounds
+    # peak memory by --chunksize and only parses STREAM_COLS.
+    chunksize = args.chunksize if args.stream else None
+    columns = STREAM_COLS if args.stream and not args.all_columns else None
+
+    if args.check_indexes:
+        collection = connect_collection()
+        print(f"Indexes on {collection.name}:")
+        missing, retired = check_indexes(collection)
+        if missing:
+            print(f"{len(missing)} index(es) missing; run main/main.py (any mode) to create them.")
+        if retired:
+            print(f"{len(retired)} retired index(es) present; run main/main.py (any mode) to drop them.")
+        if missing or retired:
+            raise SystemExit(1)
+        return
+
+    csv_files = find_csv_files()
+    collection = connect_collection()
+
+    # With --workers each file is parsed and cleaned in its own process, and
+    # the cleaned chunks come back through bounded queues owned by the manager
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    manager = Manager() if pool is not None else None
+    try:
+        if args.incremental:
+            run_incremental(args, csv_files, chunksize, columns, pool, manager, collection)
+        else:
+            run_full(args, csv_files, chunksize, columns, pool, manager, collection)
+    finally:
+        if pool is not None:
+            # closing the queues first releases workers waiting on a full one
+            manager.shutdown()
+            pool.shutdown(cancel_futures=True)
+
+    print("Total documents in collection:", collection.count_documents({}))
+    print("First document:")
+    print(collection.find_one())
+
+
+def run_full(args, csv_files, chunksize, columns, pool, manager, collection):
+    # -------- Pass 1: accumulate z-score statistics --------
+    partials = scan_files(csv_files, chunksize, pool)
+    stats = merge_stats(partial for partial, _ in partials.values())
+    lenient = {path: file_lenient for path, (_, file_lenient) in partials.items()}
+
+    print("Loaded files:", [os.path.basename(f) for f in csv_files])
+    print("Total rows:", stats.rows)
+
+    # compute z-scores across the whole combined dataset
+    means = stats.means()
+    stds = stats.stds()
+
+    # -------- Pass 2: filter, write cleaned CSV and save to MongoDB --------
+    db = collection.database
+    if args.swap:
+        # Load into a fresh staging collection; readers keep seeing the old
+        # data until it is renamed over the live collection below.
+        target = db[collection.name + STAGING_SUFFIX]
+        target.drop()
+    else:
+        # Clear the collection before inserting cleaned records (intentional behavior)
+        target = collection
+        target.delete_many({})
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)  # create folder if it doesn't exist
+
+    loader = BulkLoader(target, args.batch_size, args.writers)
+    # derived docs are written as each source file is finished, next to the
+    # rows (into staging collections with --swap)
+    derived = []
+    for name, indexes, cls in DERIVED_OUTPUTS:
+        if args.swap:
+            derived_target = db[name + STAGING_SUFFIX]
+            derived_target.drop()
+        else:
+            derived_target = db[name]
+            derived_target.delete_many({})
+        derived_target.create_indexes(indexes)
+        derived.append((derived_target, name, cls()))
+    # the Parquet copy is built beside the live one and moved over it at the end
+    parquet_staging = PARQUET_DIR + STAGING_SUFFIX
+    parquet = None
+    if pq is not None:
+        shutil.rmtree(parquet_staging, ignore_errors=True)
+        parquet = ParquetDataset(parquet_staging)
+    # opt-in, or kept up to date once an earlier run built it
+    local = None
+    if args.local_store or local_store_dir(LOCAL_STORE_DIR) is not None:
+        local = LocalStore(LOCAL_STORE_DIR)
+    removed_rows = 0
+    header = None
+    with open(OUTPUT_PATH, "w", newline="") as out:
+        cleaned = iter_cleaned(args, csv_files, means, stds, columns, chunksize, lenient, pool, manager)
+        for path, group in groupby(cleaned, key=itemgetter(0)):
+            for _, df_clean, removed in group:
+                removed_rows += removed
+                if header is None:
+                    # the rolling scores go to MongoDB only; cleaned.csv keeps the source columns
+                    header = [c for c in df_clean.columns if c not in ROLLING_SCORES.values()]
+                    df_clean[header].to_csv(out, index=False)
+                else:
+                    # files may not share every column; keep the CSV aligned with its header
+                    df_clean.reindex(columns=header).to_csv(out, index=False, header=False)
+                loader.add(df_clean, source_key(path))
+                if parquet is not None:
+                    parquet.add(df_clean, source_key(path))
+                if local is not None:
+                    local.add(df_clean, source_key(path))
+                for _, _, accumulator in derived:
+                    accumulator.add(df_clean, source_key(path))
+            for derived_target, _, accumulator in derived:
+                insert_batches(derived_target, accumulator.pop_docs(source_key(path)), args.batch_size)
+    loader.close()
+
+    print_report(stats.rows, removed_rows)
+    print(f"Cleaned data saved to {OUTPUT_PATH}")
+    if parquet is not None:
+        parquet.close()
+        replace_dir(parquet_staging, PARQUET_DIR)
+        print(f"Parquet dataset saved to {PARQUET_DIR}")
+    else:
+        print(f"pyarrow is not installed; skipped the Parquet dataset at {PARQUET_DIR}")
+
+    if args.swap:
+        swap_collection(target, collection)
+        for staging, name, _ in derived:
+            staging.rename(name, dropTarget=True)
+    else:
+        ensure_indexes(collection)
+
+    generation = bump_generation(collection)
+    if local is not None:
+        local.close(generation)
+        print(f"Local column store saved to {local.root}")
+
+    # Record what was loaded so later --incremental runs start from here
+    manifest = collection.database[MANIFEST_COLLECTION]
+    manifest.delete_many({})
+    manifest.insert_many([manifest_entry(path, partial) for path, (partial, _) in partials.items()])
+
+
+def run_incremental(args, csv_files, chunksize, columns, pool, manager, collection):
+    manifest = collection.database[MANIFEST_COLLECTION]
+    manifest_docs = {doc["_id"]: doc for doc in manifest.find()}
+
+    current = {source_key(path) for path in csv_files}
+    deleted = [key for key in manifest_docs if key not in current]
+    changed, hashes = changed_files(csv_files, manifest_docs)
+
+    print("Changed or new files:", [os.path.basename(f) for f in changed])
+    print("Removed files:", deleted)
+    if not changed and not deleted:
+        print("Collection is up to date; nothing to ingest.")
+        return
+
+    # -------- Pass 1: statistics for changed files only --------
+    # Unchanged files contribute the partial stats stored in their manifest
+    # entry, so the global z-score never needs a full re-read. Only the
+    # changed files are filtered with it, though: unchanged files keep the
+    # rows the earlier thresholds let through, so with --outlier-mode global
+    # the collection drifts from what a full run would load as the statistics
+    # move. A full --swap rebuild re-filters everything (see the README).
+    partials = scan_files(changed, chunksize, pool)
+    changed_keys = {source_key(path) for path in changed}
+    stats = merge_stats(
+        [RunningStats.from_doc(doc["stats"]) for key, doc in manifest_docs.items()
+         if key in current and key not in changed_keys]
+        + [partial for partial, _ in partials.values()]
+    )
+    lenient = {path: file_lenient for path, (_, file_lenient) in partials.items()}
+
+    print("Total rows:", stats.rows)
+
+    means = stats.means()
+    stds = stats.stds()
+
+    ensure_indexes(collection)
+    derived = [(collection.database[name], indexes, cls()) for name, indexes, cls in DERIVED_OUTPUTS]
+    for key in deleted:
+        collection.delete_many({"source_file": key})
+        for target, _, _ in derived:
+            target.delete_many({"source_file": key})
+        manifest.delete_one({"_id": key})
+
+    # -------- Pass 2: replace each changed file's documents --------
+    # cleaned.csv is a full-rebuild artifact and is left untouched here; the
+    # Parquet dataset has one file per source file and day, so those are
+    # replaced like the documents once a full run has created it.
+    parquet = ParquetDataset(PARQUET_DIR) if pq is not None and os.path.isdir(PARQUET_DIR) else None
+    if parquet is not None:
+        for key in deleted:
+            parquet.remove_source(key)
+    # the local column store is rebuilt whole: unchanged files' rows are copied
+    # over, so only a store a full run created can be kept up to date here
+    local = None
+    if local_store_dir(LOCAL_STORE_DIR) is not None:
+        local = LocalStore(LOCAL_STORE_DIR)
+        local.keep(LOCAL_STORE_DIR, changed_keys | set(deleted))
+    elif args.local_store:
+        print("No local column store to update; run a full load with --local-store to create it.")
+    loader = BulkLoader(collection, args.batch_size, args.writers)
+    removed_rows = 0
+    changed_rows = 0
+    cleaned = iter_cleaned(args, changed, means, stds, columns, chunksize, lenient, pool, manager)
+    seen = set()
+    for path, group in groupby(cleaned, key=itemgetter(0)):
+        seen.add(path)
+        collection.delete_many({"source_file": source_key(path)})
+        if parquet is not None:
+            parquet.remove_source(source_key(path))
+        for _, df_clean, removed in group:
+            removed_rows += removed
+            loader.add(df_clean, source_key(path))
+            if parquet is not None:
+                parquet.add(df_clean, source_key(path))
+            if local is not None:
+                local.add(df_clean, source_key(path))
+            for _, _, accumulator in derived:
+                accumulator.add(df_clean, source_key(path))
+        # only record the file once all of its batches are written
+        loader.flush()
+        if parquet is not None:
+            parquet.close_source()
+        for target, indexes, accumulator in derived:
+            write_derived(target, indexes, accumulator.pop_docs(source_key(path)), source_key(path), args.batch_size)
+        partial = partials[path][0]
+        changed_rows += partial.rows
+        manifest.replace_one({"_id": source_key(path)}, manifest_entry(path, partial, hashes.get(path)), upsert=True)
+
+    # changed files that produced no rows at all
+    for path in changed:
+        if path not in seen:
+            collection.delete_many({"source_file": source_key(path)})
+            if parquet is not None:
+                parquet.remove_source(source_key(path))
+            for target, _, _ in derived:
+                target.delete_many({"source_file": source_key(path)})
+            manifest.replace_one({"_id": source_key(path)},
+                                 manifest_entry(path, partials[path][0], hashes.get(path)), upsert=True)
 
-df_clean = df_clean.replace({np.nan: None})
+    # unchanged files whose mtime moved but whose content hash still matches
+    for path in csv_files:
+        key = source_key(path)
+        if key in manifest_docs and key not in changed_keys and path in hashes:
+            entry = manifest_docs[key]
+            manifest.update_one({"_id": key}, {"$set": {"size": entry["size"], "mtime": entry["mtime"]}})
 
-records = df_clean.to_dict("records")
-if records:  
-    collection.insert_many(records)
+    loader.close()
+    if parquet is not None:
+        parquet.close()
+    generation = bump_generation(collection)
+    if local is not None:
+        local.close(generation)
+    print_report(changed_rows, removed_rows)
 
 
-print("Total documents in collection:", collection.count_documents({}))
-print("First document:")
-print(collection.find_one())
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+
+import mongomock
+import numpy as np
+import pandas as pd
+
+import main
+
+
+def test_geo_tiles_merge_every_zoom_from_the_finest():
+    rng = np.random.default_rng(7)
+    n = 3000
+    df = pd.DataFrame({
+        "Latitude": 25.9 + rng.normal(0, 0.01, n),
+        "Longitude": -80.15 + rng.normal(0, 0.01, n),
+        "Date": rng.choice(["10/21/21", "10/22/21"], n),
+        "Temperature (c)": rng.normal(28, 1, n),
+        "Salinity (ppt)": np.where(rng.random(n) < 0.1, np.nan, rng.normal(35, 2, n)),
+    })
+    tiles = main.GeoTiles()
+    for start in range(0, n, 450):
+        chunk = df.iloc[start:start + 450]
+        tiles.add(chunk, "a.csv")
+    docs = list(tiles.pop_docs("a.csv"))
+    assert tiles.parts == {}
+
+    for zoom in main.TILE_ZOOMS:
+        x, y = main.tile_coords(df["Latitude"].to_numpy(), df["Longitude"].to_numpy(), zoom)
+        expected = df.assign(x=x, y=y).groupby(["Date", "x", "y"]).agg(
+            count=("Latitude", "size"), lat_min=("Latitude", "min"), salinity_count=("Salinity (ppt)", "count"),
+            salinity_sum=("Salinity (ppt)", "sum"))
+        got = pd.DataFrame([d for d in docs if d["zoom"] == zoom]).set_index(["date", "x", "y"]).sort_index()
+        assert len(got) == len(expected)
+        assert got["count"].tolist() == expected["count"].tolist()
+        assert got["salinity_count"].tolist() == expected["salinity_count"].tolist()
+        np.testing.assert_allclose(got["salinity_sum"], expected["salinity_sum"])
+        np.testing.assert_array_equal(got["lat_min"], expected["lat_min"])
+    assert {d["day"] for d in docs} == {"2021-10-21", "2021-10-22"}
+    assert all(type(d["count"]) is int for d in docs)
+
+
+def write_mission_csv(path, n=500):
+    rng = np.random.default_rng(11)
+    temperature = rng.normal(28, 0.2, n)
+    temperature[::37] += 5  # spikes for the rolling score to catch
+    pd.DataFrame({
+        "Latitude": 25.9 + rng.normal(0, 0.01, n),
+        "Longitude": -80.15 + rng.normal(0, 0.01, n),
+        "Date": np.repeat(["10/21/21", "10/22/21"], [n // 2, n - n // 2]),
+        "Time": "12:00:00",
+        "Time hh:mm:ss": "12:00:00",
+        "pH": 8.1,
+        "Temperature (c)": temperature,
+        "Salinity (ppt)": np.where(rng.random(n) < 0.05, np.nan, rng.normal(35, 0.5, n)),
+        "ODO mg/L": rng.normal(6, 0.3, n),
+    }).to_csv(path, index=False)
+
+
+def test_rolling_scores_do_not_depend_on_the_chunk_size(tmp_path):
+    path = str(tmp_path / "mission.csv")
+    write_mission_csv(path)
+    means = pd.Series(0.0, index=main.NUMERIC_COLS)
+    stds = pd.Series(np.inf, index=main.NUMERIC_COLS)
+
+    def clean(chunksize):
+        chunks = list(main.clean_files([path], means, stds, main.STREAM_COLS, chunksize, {}, "rolling"))
+        return chunks, pd.concat([cleaned for _, cleaned, _ in chunks], ignore_index=True)
+
+    whole_chunks, whole = clean(None)
+    small_chunks, small = clean(7)
+    assert len(whole_chunks) == 1  # the held-back rows go out with the last chunk
+    assert sum(n for *_, n in whole_chunks) == sum(n for *_, n in small_chunks) > 0
+    pd.testing.assert_frame_equal(whole, small)
+    assert whole["rolling_z_temperature"].notna().all()
+
+
+def test_rolling_robust_z_blocks_match_one_window_array():
+    rng = np.random.default_rng(3)
+    values = rng.normal(0, 1, (1000, 2))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    np.testing.assert_allclose(main.rolling_robust_z(values, block=64),
+                               main.rolling_robust_z(values, block=len(values)), equal_nan=True)
+
+
+def test_parallel_cleaning_streams_the_serial_chunks(tmp_path):
+    paths = [str(tmp_path / f"mission{i}.csv") for i in range(3)]
+    for path in paths:
+        write_mission_csv(path)
+    means = pd.Series([28.0, 35.0, 6.0], index=main.NUMERIC_COLS)
+    stds = pd.Series([0.5, 0.5, 0.3], index=main.NUMERIC_COLS)
+    serial = list(main.clean_files(paths, means, stds, main.STREAM_COLS, 100, {}))
+
+    with ProcessPoolExecutor(max_workers=2) as pool, Manager() as manager:
+        parallel = list(main.parallel_clean_files(pool, manager, paths, means, stds, main.STREAM_COLS, 100, {},
+                                                  window=2))
+    assert [(path, removed) for path, _, removed in parallel] == [(path, removed) for path, _, removed in serial]
+    for (_, expected, _), (_, got, _) in zip(serial, parallel):
+        pd.testing.assert_frame_equal(got, expected)
+
+
+def test_index_sync_drops_retired_indexes(capsys):
+    db = mongomock.MongoClient().db
+    live = db.asv_1
+    live.create_index([("date", 1), ("temperature", 1)], name="date_temperature")
+    live.create_index([("pH", 1)], name="ph_by_hand")
+    missing, retired = main.check_indexes(live)
+    assert "timestamp_id" in missing and retired == ["date_temperature"]
+
+    staging = db.asv_1_staging
+    staging.insert_one({"temperature": 1.0})
+    main.swap_collection(staging, live)
+    assert main.check_indexes(db.asv_1) == ([], [])
+    assert "ph_by_hand" in db.asv_1.index_information()
+    assert "EXTRA    ph_by_hand" in capsys.readouterr().out
+
+    db.asv_1.create_index([("date", 1), ("odo", 1)], name="date_odo")
+    main.ensure_indexes(db.asv_1)
+    assert "date_odo" not in db.asv_1.index_information()
+
+
+def digest_quantiles(digests, n, lo, hi):
+    """The API's interpolation over pooled centroids (see _summary_stats)."""
+    centroids = np.array([c for d in digests for c in d.centroids()])
+    centroids = centroids[np.argsort(centroids[:, 0], kind="mergesort")]
+    ranks = np.cumsum(centroids[:, 1]) - centroids[:, 1] / 2
+    return np.interp(np.array([1, 5, 25, 50, 75, 95, 99]) / 100 * n, np.r_[0, ranks, n], np.r_[lo, centroids[:, 0], hi])
+
+
+def test_tdigest_keeps_small_groups_exact():
+    rng = np.random.default_rng(5)
+    values = np.concatenate([rng.normal(12, 0.5, 300), rng.normal(40, 1, 500)])  # a gap like salinity's
+    digest = main.TDigest()
+    for part in np.array_split(values, 4):
+        digest.update(part)
+    centroids = np.array(digest.centroids())
+    assert (centroids[:, 1] == 1).all()
+    np.testing.assert_array_equal(centroids[:, 0], np.sort(values))
+
+
+def test_tdigest_rank_error_is_bounded_on_large_groups():
+    rng = np.random.default_rng(1)
+    values = np.concatenate([rng.normal(10, 1, 60000), rng.normal(40, 3, 140000)])
+    rng.shuffle(values)
+    digests = []
+    for part in np.array_split(values, 20):
+        digest = main.TDigest()
+        for chunk in np.array_split(part, 5):
+            digest.update(chunk)
+        digests.append(digest)
+    assert all(len(d.means) <= d.delta / 2 + 1 for d in digests)
+
+    estimates = digest_quantiles(digests, len(values), values.min(), values.max())
+    ranks = np.searchsorted(np.sort(values), estimates) / len(values)
+    assert np.abs(ranks - np.array([1, 5, 25, 50, 75, 95, 99]) / 100).max() < 0.005